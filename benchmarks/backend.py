@@ -0,0 +1,88 @@
+"""A quiet in-memory backend for benchmarking automation runs."""
+import asyncio
+import zlib
+from functools import total_ordering
+from ottoscript.interpreters import Interpreter
+from ottoscript.logs import LEVELS
+
+
+class QuietLogger:
+    """Logger that drops everything.
+
+    Messages at level and above are still built and awaited, so runs
+    pay for logging as they would with a real logger at that level.
+    """
+
+    def __init__(self, level=None):
+        self.level = level
+
+    def set_task(self, task):
+        pass
+
+    def is_enabled(self, level):
+        return (self.level is not None
+                and LEVELS[level] >= LEVELS[self.level])
+
+    async def info(self, message):
+        pass
+
+    async def error(self, message):
+        pass
+
+    async def warning(self, message):
+        pass
+
+    async def debug(self, message):
+        pass
+
+
+@total_ordering
+class Reading:
+    """A state value that compares with strings and numbers alike.
+
+    Generated conditions compare sensors with both, so every entity
+    gets a stable reading derived from its name.
+    """
+
+    def __init__(self, name):
+        self.value = zlib.crc32(name.encode()) % 100
+
+    def __eq__(self, other):
+        return str(self.value) == str(other)
+
+    def __lt__(self, other):
+        return str(self.value) < str(other)
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+
+class BenchInterpreter(Interpreter):
+    """Interpreter with an optional simulated round-trip per call"""
+
+    def __init__(self, logger=None, latency=0.0):
+        super().__init__(logger=logger or QuietLogger())
+        self.latency = latency
+        self.calls = 0
+
+    async def roundtrip(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get_state(self, entity_name):
+        await self.roundtrip()
+        return Reading(entity_name)
+
+    async def set_state(self, entity_name, value=None,
+                        new_attributes=None, kwargs=None):
+        await self.roundtrip()
+
+    async def call_service(self, domain, service_name, **kwargs):
+        await self.roundtrip()
+
+    async def sleep(self, seconds):
+        pass
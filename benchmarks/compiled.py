@@ -0,0 +1,72 @@
+"""Compare runs per second of compiled closures and the VM with eval().
+
+Run with ``python -m benchmarks.compiled``.
+"""
+import argparse
+import asyncio
+import json
+from functools import partial
+from time import perf_counter
+from ottoscript import vm
+from ottoscript.compiler import assemble, compile_auto
+from ottoscript.ottobase import OttoBase, OttoContext
+from ottoscript.program import Program
+from .backend import BenchInterpreter, QuietLogger
+from .generator import Generator, add_workload_arguments, workload_from_args
+
+
+async def measure(runs, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        for run in runs:
+            await run()
+    elapsed = perf_counter() - start
+
+    return {
+        'runs': len(runs) * repeat,
+        'seconds': elapsed,
+        'runs_per_sec': len(runs) * repeat / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_workload_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    workload = workload_from_args(args)
+    log = QuietLogger()
+    OttoBase.set_context(
+        OttoContext(interpreter=BenchInterpreter(logger=log), logger=log)
+    )
+    autos = list(Program(Generator(workload).program()))
+
+    start = perf_counter()
+    compiled = [compile_auto(auto) for auto in autos]
+    compile_time = perf_counter() - start
+
+    start = perf_counter()
+    codes = [assemble(auto) for auto in autos]
+    assemble_time = perf_counter() - start
+    lowered = [partial(vm.run, code) for code in codes]
+
+    tree = asyncio.run(measure([a.actions.eval for a in autos], args.repeat))
+    flat = asyncio.run(measure(compiled, args.repeat))
+    linear = asyncio.run(measure(lowered, args.repeat))
+
+    print(json.dumps({
+        'workload': workload.as_dict(),
+        'compile_seconds': compile_time,
+        'assemble_seconds': assemble_time,
+        'instructions': sum(len(code) for code in codes),
+        'eval': tree,
+        'compiled': flat,
+        'vm': linear,
+        'compiled_speedup': flat['runs_per_sec'] / tree['runs_per_sec'],
+        'vm_speedup': linear['runs_per_sec'] / tree['runs_per_sec']
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
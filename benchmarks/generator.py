@@ -0,0 +1,147 @@
+"""Seeded generator of synthetic .otto programs.
+
+Run with ``python -m benchmarks.generator --output bundle.otto`` to write
+a program to disk.
+"""
+import argparse
+import random
+
+DOMAINS = ["light", "switch", "fan", "lock", "cover"]
+NAMES = ["office", "kitchen", "hallway", "porch", "garage", "bedroom",
+         "bathroom", "stairs", "attic", "basement", "patio", "den"]
+DAYS = ["MON", "TUE", "WED", "THU", "FRI", "WEEKDAY", "WEEKEND"]
+OPERATORS = ["==", "!=", ">", "<", ">=", "<="]
+
+
+class Workload:
+    """Shape of a generated program"""
+
+    def __init__(self, automations=100, triggers=2, depth=2, targets=3,
+                 areas=1, with_keys=2, seed=0):
+        self.automations = automations
+        self.triggers = triggers
+        self.depth = depth
+        self.targets = targets
+        self.areas = areas
+        self.with_keys = with_keys
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class Generator:
+
+    def __init__(self, workload):
+        self.workload = workload
+        self.rng = random.Random(workload.seed)
+
+    def entity(self, domain=None):
+        domain = domain or self.rng.choice(DOMAINS)
+        return f"{domain}.{self.rng.choice(NAMES)}_{self.rng.randrange(50)}"
+
+    def entities(self, domain):
+        return ", ".join(self.entity(domain)
+                         for _ in range(self.workload.targets))
+
+    def areas(self):
+        return ", ".join(self.rng.choice(NAMES)
+                         for _ in range(self.workload.areas))
+
+    def with_data(self):
+        if self.workload.with_keys == 0:
+            return ""
+
+        pairs = ", ".join(f"key_{n}={self.rng.randrange(100)}"
+                          for n in range(self.workload.with_keys))
+        return f" WITH ({pairs})"
+
+    def trigger(self):
+        kind = self.rng.randrange(3)
+
+        if kind == 0:
+            return (f"WHEN {self.entity('binary_sensor')} CHANGES"
+                    f" TO 'on' FOR {self.rng.randrange(1, 10)} MINUTES")
+        if kind == 1:
+            hour = self.rng.randrange(24)
+            return f"WHEN {hour:02}:00 ON {self.rng.choice(DAYS)}"
+
+        return f"WHEN {self.rng.randrange(1, 60)} MINUTES BEFORE SUNSET"
+
+    def comparison(self):
+        left = self.rng.choice([self.entity("sensor"), "@mode"])
+        right = self.rng.choice(["'on'", "'away'",
+                                 str(self.rng.randrange(50))])
+        return f"{left} {self.rng.choice(OPERATORS)} {right}"
+
+    def condition(self):
+        return (f"{self.comparison()} AND"
+                f" ({self.comparison()} OR NOT {self.comparison()})")
+
+    def command(self):
+        kind = self.rng.randrange(4)
+        domain = self.rng.choice(["light", "switch", "fan"])
+
+        if kind == 0 and self.workload.areas:
+            return (f"TURN ON {domain.upper()} AREA {self.areas()}"
+                    f"{self.with_data()}")
+        if kind == 1:
+            return (f"DIM {self.entities('light')}"
+                    f" TO {self.rng.randrange(101)}%")
+        if kind == 2:
+            return f"LOCK {self.entities('lock')}{self.with_data()}"
+
+        return (f"TURN OFF {domain.upper()} {self.entities(domain)}"
+                f"{self.with_data()}")
+
+    def block(self, depth):
+        if depth == 0:
+            return "\n".join(self.command() for _ in range(2))
+
+        inner = self.block(depth - 1)
+
+        if self.rng.randrange(2):
+            return (f"IF {self.condition()}\n{inner}\n"
+                    f"ELSE\n{self.command()}\nEND")
+
+        return (f"SWITCH\nCASE {self.condition()}\n{inner}\n"
+                f"CASE {self.condition()}\n{self.command()}\n"
+                f"DEFAULT\n{self.command()}\nEND")
+
+    def automation(self, n):
+        triggers = "\n".join(self.trigger()
+                             for _ in range(self.workload.triggers))
+        return (f"AUTO generated_{n}\n{triggers}\n"
+                f"{self.block(self.workload.depth)}\n;\n")
+
+    def program(self):
+        header = "@mode = input_select.house_mode\n\n"
+        return header + "\n".join(self.automation(n)
+                                  for n in range(self.workload.automations))
+
+
+def add_workload_arguments(parser):
+    defaults = Workload()
+    for name, value in defaults.as_dict().items():
+        parser.add_argument(f"--{name.replace('_', '-')}",
+                            type=int,
+                            default=value)
+
+
+def workload_from_args(args):
+    return Workload(**{name: getattr(args, name)
+                       for name in Workload().as_dict()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_workload_arguments(parser)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    with open(args.output, "w") as file:
+        file.write(Generator(workload_from_args(args)).program())
+
+
+if __name__ == "__main__":
+    main()
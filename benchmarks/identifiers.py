@@ -0,0 +1,60 @@
+"""Compare identifier matching with the keyword lookahead and the set lookup.
+
+Run with ``python -m benchmarks.identifiers``.
+"""
+import argparse
+import random
+from time import perf_counter
+from pyparsing import Group, Literal, OneOrMore, common
+from ottoscript.datatypes import ident
+from ottoscript.keywords import reserved_words
+
+WORDS = ["light", "switch", "sensor", "office", "kitchen", "hallway",
+         "ceiling", "lamp", "motion", "door", "front", "porch"]
+
+
+def lookahead_ident():
+    """The identifier as it was built before the set lookup"""
+    return (~reserved_words + common.identifier).set_parse_action(
+        lambda x: x[0])
+
+
+def entities(identifier):
+    return OneOrMore(Group(identifier + Literal(".") + identifier))
+
+
+def source(count, seed):
+    rng = random.Random(seed)
+    names = [f"{rng.choice(WORDS)}.{rng.choice(WORDS)}_{n}"
+             for n in range(count)]
+    return " ".join(names)
+
+
+def measure(parser, text, repeat):
+    parser.parse_string(text)
+    start = perf_counter()
+    for _ in range(repeat):
+        parser.parse_string(text)
+    return (perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entities", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    text = source(args.entities, args.seed)
+    identifiers = 2 * args.entities
+
+    print(f"{'matcher':>10} {'ms/parse':>10} {'idents/sec':>12}")
+    for label, identifier in (("lookahead", lookahead_ident()),
+                              ("set", ident)):
+        seconds = measure(entities(identifier), text, args.repeat)
+        print(f"{label:>10} {seconds * 1000:>10.2f}"
+              f" {identifiers / seconds:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
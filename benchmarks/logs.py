@@ -0,0 +1,65 @@
+"""Compare Condition and CommandBlock throughput with logging off and on.
+
+Loggers that say a level is off through is_enabled() skip building
+and awaiting its messages; at info every message is still built and
+then dropped.
+
+Run with ``python -m benchmarks.logs``.
+"""
+import argparse
+import asyncio
+import json
+from time import perf_counter
+from ottoscript.conditionals import CommandBlock, Condition
+from ottoscript.ottobase import OttoBase, OttoContext
+from .backend import BenchInterpreter, QuietLogger
+
+CONDITION = ("sensor.a > 10 AND sensor.b < 90"
+             " AND (sensor.c == 'on' OR sensor.d == 'on')")
+
+BLOCK = """TURN ON light light.porch
+           TURN OFF light light.hall
+           LOCK lock.front_door
+           SET input_text.mode TO 'away'
+           """
+
+
+async def measure(node, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        await node.eval()
+    elapsed = perf_counter() - start
+
+    return repeat / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {}
+    for level in (None, 'info'):
+        log = QuietLogger(level=level)
+        OttoBase.set_context(
+            OttoContext(interpreter=BenchInterpreter(logger=log), logger=log)
+        )
+
+        label = level or 'off'
+        results[label] = {
+            'condition_evals_per_sec': asyncio.run(
+                measure(Condition().parse_string(CONDITION)[0], args.repeat)),
+            'block_evals_per_sec': asyncio.run(
+                measure(CommandBlock().parse_string(BLOCK)[0], args.repeat))
+        }
+
+    results['speedup'] = {
+        key: results['off'][key] / results['info'][key]
+        for key in results['off']
+    }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Compare memory held per automation with and without compact nodes.
+
+Each measurement runs in a fresh process. Run with
+``python -m benchmarks.memory``.
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import tracemalloc
+from ottoscript.ottobase import OttoBase, OttoContext
+from ottoscript.program import Program
+from .generator import Generator, add_workload_arguments, workload_from_args
+
+
+def resident_bytes():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+def measure(workload, compact, traced):
+    source = Generator(workload).program()
+    OttoBase.set_context(OttoContext(compact=compact))
+
+    # Build the grammar first so it isn't counted against the trees.
+    next(iter(Program(source.split(";")[0])))
+    gc.collect()
+
+    if traced:
+        tracemalloc.start()
+    before = resident_bytes()
+
+    autos = list(Program(source))
+    gc.collect()
+
+    after = resident_bytes()
+    if traced:
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return retained / len(autos)
+
+    if before is None:
+        return None
+    return (after - before) / len(autos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_workload_arguments(parser)
+    args = parser.parse_args()
+    workload = workload_from_args(args)
+
+    results = {'workload': workload.as_dict()}
+    spawn = multiprocessing.get_context("spawn")
+
+    with spawn.Pool(1, maxtasksperchild=1) as pool:
+        for label, compact in (("full", False), ("compact", True)):
+            results[label] = {
+                'rss_bytes_per_automation':
+                    pool.apply(measure, (workload, compact, False)),
+                'traced_bytes_per_automation':
+                    pool.apply(measure, (workload, compact, True))
+            }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compare Auto parse time and memory with packrat caching on and off.
+
+Run with ``python -m benchmarks.packrat``.
+"""
+import argparse
+import tracemalloc
+from time import perf_counter
+from ottoscript.controls import Auto
+from ottoscript.ottobase import OttoBase, packrat_mode, packrat_stats
+
+CONDITION = "light.a == 'on' AND (sensor.b > 5 OR NOT @mode == 'away')"
+
+
+def nested_actions(depth):
+    if depth == 0:
+        return "TURN ON LIGHT light.a"
+
+    inner = nested_actions(depth - 1)
+
+    if depth % 2:
+        return f"IF {CONDITION} {inner} ELSE PASS END"
+
+    return (f"SWITCH CASE {CONDITION} {inner}"
+            f" CASE {CONDITION} PASS DEFAULT PASS END")
+
+
+def nested_source(depth):
+    return f"AUTO bench WHEN light.a CHANGES {nested_actions(depth)}"
+
+
+def measure(source, repeat, cache_size=None):
+    parser = Auto()
+
+    # The first parse streamlines the grammar; keep it out of the timing.
+    parser.parse_string(source)
+
+    tracemalloc.start()
+    start = perf_counter()
+
+    if cache_size is None:
+        stats = None
+        for _ in range(repeat):
+            parser.parse_string(source)
+    else:
+        with packrat_mode(cache_size):
+            for _ in range(repeat):
+                parser.parse_string(source)
+            stats = packrat_stats()
+
+    elapsed = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'seconds_per_parse': elapsed / repeat,
+        'peak_kib': peak / 1024,
+        'cache': stats
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    OttoBase.set_context()
+
+    print(f"{'depth':>5} {'mode':>8} {'ms/parse':>10} {'peak KiB':>10}"
+          f" {'hits':>8} {'misses':>8}")
+
+    for depth in args.depths:
+        source = nested_source(depth)
+        for label, size in (("off", None), ("packrat", args.cache_size)):
+            result = measure(source, args.repeat, size)
+            cache = result['cache'] or {'hits': '-', 'misses': '-'}
+            print(f"{depth:>5} {label:>8}"
+                  f" {result['seconds_per_parse'] * 1000:>10.2f}"
+                  f" {result['peak_kib']:>10.1f}"
+                  f" {cache['hits']:>8} {cache['misses']:>8}")
+
+
+if __name__ == "__main__":
+    main()
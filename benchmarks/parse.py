@@ -0,0 +1,82 @@
+"""Measure parse throughput on a generated workload.
+
+Run with ``python -m benchmarks.parse --output results.json``.
+"""
+import argparse
+import json
+import platform
+import tracemalloc
+from collections import Counter
+from time import perf_counter
+from ottoscript import __version__
+from ottoscript.ottobase import OttoBase, grammar_registry
+from ottoscript.program import Program
+from .generator import Generator, add_workload_arguments, workload_from_args
+
+COUNTED_NODES = ["Auto", "Condition", "CommandBlock", "Target"]
+
+
+def run(workload, packrat=False):
+    OttoBase.set_context()
+    source = Generator(workload).program()
+
+    # Build the grammar outside of the measurement.
+    build_start = perf_counter()
+    next(iter(Program(source.split(";")[0])))
+    build_time = perf_counter() - build_start
+
+    start = perf_counter()
+    autos = list(Program(source, packrat=packrat))
+    elapsed = perf_counter() - start
+
+    # tracemalloc slows parsing down a lot, so memory gets its own pass.
+    tracemalloc.start()
+    list(Program(source, packrat=packrat))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    nodes = Counter(type(node).__name__
+                    for auto in autos
+                    for node in auto.walk())
+
+    lines = source.count("\n") + 1
+
+    return {
+        'lines': lines,
+        'automations': len(autos),
+        'seconds': elapsed,
+        'lines_per_sec': lines / elapsed,
+        'automations_per_sec': len(autos) / elapsed,
+        'peak_bytes': peak,
+        'grammar_build_seconds': build_time,
+        'grammar_elements': grammar_registry.stats()['elements'],
+        'nodes': {name: nodes[name] for name in COUNTED_NODES},
+        'total_nodes': sum(nodes.values())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_workload_arguments(parser)
+    parser.add_argument("--packrat", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    workload = workload_from_args(args)
+    results = {
+        'ottoscript': __version__,
+        'python': platform.python_version(),
+        'workload': workload.as_dict(),
+        'packrat': args.packrat,
+        'results': run(workload, packrat=args.packrat)
+    }
+
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
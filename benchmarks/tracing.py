@@ -0,0 +1,70 @@
+"""Measure what tracing costs.
+
+Runs generated automations through eval(), compiled closures and the
+VM, with tracing off and on.
+
+Run with ``python -m benchmarks.tracing``.
+"""
+import argparse
+import asyncio
+import json
+from functools import partial
+from time import perf_counter
+from ottoscript import vm
+from ottoscript.compiler import assemble, compile_auto
+from ottoscript.ottobase import OttoBase, OttoContext
+from ottoscript.program import Program
+from .backend import BenchInterpreter, QuietLogger
+from .generator import Generator, add_workload_arguments, workload_from_args
+
+
+async def measure(ctx, runs, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        for name, run in runs:
+            with ctx.run(name):
+                await run()
+    elapsed = perf_counter() - start
+
+    return len(runs) * repeat / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_workload_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    log = QuietLogger()
+    ctx = OttoContext(interpreter=BenchInterpreter(logger=log), logger=log)
+    OttoBase.set_context(ctx)
+    autos = list(Program(Generator(workload_from_args(args)).program()))
+
+    paths = {
+        'eval': [auto.actions.eval for auto in autos],
+        'compiled': [compile_auto(auto) for auto in autos],
+        'vm': [partial(vm.run, assemble(auto)) for auto in autos]
+    }
+
+    results = {}
+    for path, steps in paths.items():
+        runs = [(auto.controls.name, step)
+                for auto, step in zip(autos, steps)]
+
+        ctx.tracing = False
+        off = asyncio.run(measure(ctx, runs, args.repeat))
+        ctx.tracing = True
+        on = asyncio.run(measure(ctx, runs, args.repeat))
+        ctx.tracing = False
+
+        results[path] = {
+            'runs_per_sec': {'off': off, 'on': on},
+            'overhead_on': off / on - 1,
+            'spans_per_run': sum(1 for _ in ctx.traces[-1].root.walk()) - 1
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
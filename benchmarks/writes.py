@@ -0,0 +1,78 @@
+"""Time SET over 1, 10 and 100 targets against a backend with latency.
+
+Each size is run three ways: one set_state per entity in turn (how SET
+used to write), the default concurrent set_states fallback, and a
+backend that writes every entity in a single round-trip.
+
+Run with ``python -m benchmarks.writes``.
+"""
+import argparse
+import asyncio
+import json
+from time import perf_counter
+from ottoscript.commands import Set
+from ottoscript.ottobase import OttoBase, OttoContext
+from .backend import BenchInterpreter
+
+
+class BulkBenchInterpreter(BenchInterpreter):
+    """Backend that writes any number of states in one round-trip"""
+
+    async def set_states(self, entity_names, value=None,
+                         new_attributes=None, kwargs=None):
+        await self.roundtrip()
+        return [None] * len(entity_names)
+
+
+async def serial(node):
+    value = await node.new_value.eval()
+    return [await node.ctx.set_state(e.name, value=value)
+            for e in node.targets.contents]
+
+
+async def measure(run, node, repeat):
+    interpreter = node.ctx.interpreter
+    interpreter.calls = 0
+
+    start = perf_counter()
+    for _ in range(repeat):
+        await run(node)
+    elapsed = perf_counter() - start
+
+    return {
+        'seconds_per_run': elapsed / repeat,
+        'calls_per_run': interpreter.calls / repeat
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--latency", type=float, default=0.001,
+                        help="seconds per backend round-trip")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        names = ", ".join(f"light.light_{i}" for i in range(size))
+        source = f"SET ({names}) TO 'on'"
+        result = {'targets': size}
+
+        for label, interpreter, run in [
+            ('serial', BenchInterpreter(latency=args.latency), serial),
+            ('fallback', BenchInterpreter(latency=args.latency), Set.eval),
+            ('bulk', BulkBenchInterpreter(latency=args.latency), Set.eval)
+        ]:
+            OttoBase.set_context(OttoContext(interpreter=interpreter))
+            node = Set().parse_string(source)[0]
+            result[label] = asyncio.run(measure(run, node, args.repeat))
+
+        results.append(result)
+
+    print(json.dumps({'latency': args.latency, 'results': results},
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,5 @@
+__version__ = "0.1.0"
+
 from .controls import Auto
 from .ottobase import OttoBase, OttoContext
+from .program import Program
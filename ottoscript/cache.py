@@ -0,0 +1,86 @@
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from time import perf_counter
+from . import __version__
+from .controls import Auto
+
+
+class CompiledCache:
+    """Keep parsed automations on disk so unchanged blocks skip the parser.
+
+    Entries are keyed by a hash of the ottoscript version and the block
+    source, so editing a block or upgrading ottoscript simply misses the
+    old entry.
+    """
+
+    suffix = ".otto.pickle"
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.load_time = 0.0
+        self.parse_time = 0.0
+
+    @staticmethod
+    def key(source):
+        digest = hashlib.sha256()
+        digest.update(__version__.encode())
+        digest.update(b"\0")
+        digest.update(source.encode())
+        return digest.hexdigest()
+
+    def entry(self, source):
+        return self.path / f"{self.key(source)}{self.suffix}"
+
+    def load(self, source, parse_all=False):
+        """Return the Auto for source, from disk when possible"""
+        entry = self.entry(source)
+        start = perf_counter()
+
+        try:
+            with open(entry, "rb") as file:
+                auto = pickle.load(file)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # A truncated or unreadable entry is treated as a miss
+            # and overwritten below.
+            self.errors += 1
+        else:
+            auto.bind()
+            self.hits += 1
+            self.load_time += perf_counter() - start
+            return auto
+
+        self.misses += 1
+        start = perf_counter()
+        auto = Auto.parse(source, parse_all=parse_all)
+        self.parse_time += perf_counter() - start
+        self.store(entry, auto)
+        return auto
+
+    def store(self, entry, auto):
+        temp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+
+        with open(temp, "wb") as file:
+            pickle.dump(auto, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temp, entry)
+
+    def clear(self):
+        for entry in self.path.glob(f"*{self.suffix}"):
+            entry.unlink()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'load_time': self.load_time,
+            'parse_time': self.parse_time
+        }
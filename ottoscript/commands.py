@@ -1,5 +1,5 @@
 from pyparsing import CaselessKeyword, Optional, MatchFirst, Group, Literal
-from .ottobase import OttoBase
+from .ottobase import OttoBase, grammar
 from .datatypes import (Number,
                         Entity,
                         String,
@@ -11,6 +11,7 @@ from .datatypes import (Number,
                         Target,
                         Input)
 from .keywords import WITH, ON, TO, OFF, AREA
+from .logs import is_enabled
 from .time import RelativeTime, TimeStamp
 
 PASS = CaselessKeyword("PASS")
@@ -29,18 +30,22 @@ OPEN = CaselessKeyword("OPEN")
 
 
 class Assignment(OttoBase):
-    parser = Group(
-        Var()("var")
-        + Literal('=')
-        + (Var()
-           | Entity()
-           | Dict()
-           | Number()
-           | String()
-           | (AREA + List(Area()))
-           | List()
-           )("_value")
-    )
+    __slots__ = ('var', '_value', 'namespace')
+
+    @grammar
+    def parser(cls):
+        return Group(
+            Var()("var")
+            + Literal('=')
+            + (Var()
+               | Entity()
+               | Dict()
+               | Number()
+               | String()
+               | (AREA + List(Area()))
+               | List()
+               )("_value")
+        )
 
     def __init__(self, tokens, namespace='local'):
         super().__init__(tokens)
@@ -57,15 +62,31 @@ class Assignment(OttoBase):
 
 
 class With(OttoBase):
-    parser = Group(WITH + Dict()("_value"))
+    __slots__ = ('_value',)
+
+    @grammar
+    def parser(cls):
+        return Group(WITH + Dict()("_value"))
 
     async def eval(self):
         return await self._value.eval()
 
 
 class Command(OttoBase):
+    __slots__ = ('_kwargs', 'targets', 'with_data')
+
+    # Fields holding values the command reads when it runs.
+    inputs = ('with_data',)
 
     async def eval(self):
+        domain, service_name, kwargs = await self.call()
+        result = await self.ctx.call_service(domain,
+                                             service_name,
+                                             **kwargs)
+        return result
+
+    async def call(self):
+        """Return the domain, service name and kwargs eval() calls with"""
         kwargs = self.kwargs
 
         if hasattr(self, 'targets'):
@@ -79,10 +100,17 @@ class Command(OttoBase):
         if hasattr(self, "static_data"):
             kwargs.update(self.static_data)
 
-        result = await self.ctx.interpreter.call_service(self.domain,
-                                                         self.service_name,
-                                                         **kwargs)
-        return result
+        return self.domain, self.service_name, kwargs
+
+    def coalescable(self):
+        """True if the call can be worked out early and merged with others.
+
+        That needs targets to merge and no state reads, so working
+        the call out ahead of the commands before it changes nothing.
+        """
+        return (type(self).eval is Command.eval
+                and hasattr(self, 'targets')
+                and not self.reads())
 
     @property
     def kwargs(self):
@@ -102,55 +130,137 @@ class Command(OttoBase):
     def parsers(cls):
         return [subclass() for subclass in cls.__subclasses__()]
 
+    def effects(self):
+        """Return (reads, writes) as entity names, or None if unknown.
+
+        Reads are the states the command's inputs read and writes the
+        entities it may change. An area target writes 'domain.*' and
+        '*' stands for every entity.
+        """
+        writes = self.writes()
+
+        if writes is None:
+            return None
+
+        return self.reads(), writes
+
+    def reads(self):
+        """Return the states evaluating this command reads"""
+        names = []
+
+        for key in self.inputs:
+            if hasattr(self, key):
+                names.extend(state_reads(getattr(self, key)))
+
+        return names
+
+    def writes(self):
+        if not hasattr(self, 'targets'):
+            return None
+
+        entities, areas = self.targets.ids()
+
+        if areas:
+            return list(entities) + [f"{self.domain}.*"]
+
+        return list(entities)
+
+
+def state_reads(node):
+    """Return the states evaluating node, or any var in it, reads"""
+    names = []
+
+    for item in node.walk():
+        if type(item) == Var:
+            value = item.fetch()
+            if isinstance(value, OttoBase):
+                names.extend(state_reads(value))
+        elif (type(item) == Entity
+              and item.attribute not in ('name', 'id', 'domain')):
+            names.append(item.name)
+
+    return names
+
 
 class Pass(Command):
-    parser = Group(PASS('pass'))
+    __slots__ = ('pass',)
+
+    @grammar
+    def parser(cls):
+        return Group(PASS('pass'))
 
     async def eval(self):
-        await self.ctx.interpreter.log.debug("Passing")
+        log = self.ctx.interpreter.log
+        if is_enabled(log, 'debug'):
+            await log.debug("Passing")
+
+    def writes(self):
+        return []
 
 
 class Set(Command):
-    parser = Group(
-        SET
-        + List(Entity())("targets")
-        + (TO | "=")
-        + (Var()("new_value")
-           ^ Entity()("new_value")
-           ^ String()("new_value")
-           ^ Number()("new_value"))
-    )
+    __slots__ = ('new_value',)
+
+    inputs = ('new_value',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            SET
+            + List(Entity())("targets")
+            + (TO | "=")
+            + (Var()("new_value")
+               ^ Entity()("new_value")
+               ^ String()("new_value")
+               ^ Number()("new_value"))
+        )
 
     async def eval(self):
-        callfunc = self.ctx.interpreter.set_state
         value = await self.new_value.eval()
+        return await self.ctx.set_states(self.writes(), value=value)
 
-        results = []
+    def writes(self):
+        names = []
         for e in self.targets.contents:
             if type(e) == Var:
                 e = e.fetch()
-            results.append(await callfunc(e.name, value=value))
+            names.append(e.name)
 
-        return results
+        return names
 
 
 class Wait(Command):
-    parser = Group(WAIT + (TimeStamp()("time") | RelativeTime()("time")))
+    __slots__ = ('time',)
+
+    @grammar
+    def parser(cls):
+        return Group(WAIT + (TimeStamp()("time") | RelativeTime()("time")))
 
     async def eval(self):
-        result = await self.ctx.interpreter.sleep(self.time.seconds)
+        result = await self.ctx.interpreter.sleep(self.seconds)
         return result
 
+    @property
+    def seconds(self):
+        time = self.time
+        if type(time) == Var:
+            time = time.fetch()
+        return time.seconds
+
 
 class Turn(Command):
-    parser = Group(
-        TURN + (ON ^ OFF)('command')
-        + ident("domain")
-        + Target()("targets")
-        + Optional(
-            With()("with_data")
+    __slots__ = ('command', 'domain')
+
+    @grammar
+    def parser(cls):
+        return Group(
+            TURN + (ON ^ OFF)('command')
+            + ident("domain")
+            + Target()("targets")
+            + Optional(
+                With()("with_data")
+            )
         )
-    )
 
     @property
     def service_name(self):
@@ -158,11 +268,15 @@ class Turn(Command):
 
 
 class Toggle(Command):
-    parser = Group(
-        TOGGLE
-        + ident("domain")
-        + Target()("targets")
-    )
+    __slots__ = ('domain',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            TOGGLE
+            + ident("domain")
+            + Target()("targets")
+        )
 
     @property
     def service_name(self):
@@ -170,13 +284,19 @@ class Toggle(Command):
 
 
 class Dim(Command):
-    parser = Group(
-        DIM
-        + Target()("targets")
-        + (CaselessKeyword("TO") | CaselessKeyword("BY"))("type")
-        + Input("numeric")("number")
-        + Optional('%')("use_pct")
-    )
+    __slots__ = ('type', 'number', 'use_pct', 'service_name')
+
+    inputs = ('number',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            DIM
+            + Target()("targets")
+            + (CaselessKeyword("TO") | CaselessKeyword("BY"))("type")
+            + Input("numeric")("number")
+            + Optional('%')("use_pct")
+        )
 
     @property
     def param(self):
@@ -194,7 +314,7 @@ class Dim(Command):
     def domain(self):
         return "light"
 
-    async def eval(self):
+    async def call(self):
 
         number = await self.number.eval()
 
@@ -204,17 +324,21 @@ class Dim(Command):
             self.service_name = "turn_off"
 
         self.kwargs = {self.param: number}
-        return await super().eval()
+        return await super().call()
 
 
 class Lock(Command):
-    parser = Group(
-        (LOCK ^ UNLOCK)("type")
-        + Target()("targets")
-        + Optional(
-            With()("with_data")
+    __slots__ = ('type',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            (LOCK ^ UNLOCK)("type")
+            + Target()("targets")
+            + Optional(
+                With()("with_data")
+            )
         )
-    )
 
     @property
     def service_name(self):
@@ -226,15 +350,19 @@ class Lock(Command):
 
 
 class Arm(Command):
-    _states = map(CaselessKeyword, "HOME AWAY NIGHT VACATION".split(" "))
-    parser = Group(
-        ARM
-        + MatchFirst(_states)("type")
-        + Target()("targets")
-        + Optional(
-            With()("with_data")
+    __slots__ = ('type',)
+
+    @grammar
+    def parser(cls):
+        states = map(CaselessKeyword, "HOME AWAY NIGHT VACATION".split(" "))
+        return Group(
+            ARM
+            + MatchFirst(states)("type")
+            + Target()("targets")
+            + Optional(
+                With()("with_data")
+            )
         )
-    )
 
     @property
     def service_name(self):
@@ -246,13 +374,17 @@ class Arm(Command):
 
 
 class Disarm(Command):
-    parser = Group(
-        DISARM
-        + Target()("targets")
-        + Optional(
-            With()("with_data")
+    __slots__ = ()
+
+    @grammar
+    def parser(cls):
+        return Group(
+            DISARM
+            + Target()("targets")
+            + Optional(
+                With()("with_data")
+            )
         )
-    )
 
     @property
     def service_name(self):
@@ -264,16 +396,20 @@ class Disarm(Command):
 
 
 class OpenClose(Command):
-    parser = Group(
-        (OPEN | CLOSE)("type")
-        + Target()("targets")
-        + Optional(
-            TO + (
-                Number()("position")
-                | Var()("position")
-                | Entity()("position"))
+    __slots__ = ('type', 'position')
+
+    @grammar
+    def parser(cls):
+        return Group(
+            (OPEN | CLOSE)("type")
+            + Target()("targets")
+            + Optional(
+                TO + (
+                    Number()("position")
+                    | Var()("position")
+                    | Entity()("position"))
+            )
         )
-    )
 
     @property
     def static_data(self):
@@ -297,16 +433,20 @@ class OpenClose(Command):
 
 
 class Call(Command):
-    parser = Group(
-        CALL
-        + Entity()("service")
-        + Optional(
-            ON + Target()("targets")
-        )
-        + Optional(
-            With()("with_data")
+    __slots__ = ('service',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            CALL
+            + Entity()("service")
+            + Optional(
+                ON + Target()("targets")
+            )
+            + Optional(
+                With()("with_data")
+            )
         )
-    )
 
     @property
     def domain(self):
@@ -315,3 +455,16 @@ class Call(Command):
     @property
     def service_name(self):
         return self.service.id
+
+    def writes(self):
+        # Without entity targets, the service could act on anything
+        # regardless of its own domain.
+        if not hasattr(self, 'targets'):
+            return ['*']
+
+        entities, areas = self.targets.ids()
+
+        if areas:
+            return list(entities) + ['*']
+
+        return list(entities)
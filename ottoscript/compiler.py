@@ -0,0 +1,804 @@
+import operator
+from . import vm
+from .commands import (Assignment, Command, Set, Wait, Pass, Dim, With)
+from .conditionals import (Comparison, CommandBlock, Condition,
+                           IfThenElse, Switch)
+from .controls import Actions, Auto
+from .datatypes import (Var, String, Number, Entity,
+                        Dict, Target, Input)
+from .logs import is_enabled
+from .tracing import current_span, evaluate, trace
+
+
+def handler(handlers, node):
+    """Return the handler name for node's class, if it has one"""
+    for klass in type(node).__mro__:
+        name = handlers.get(klass)
+
+        if name is not None:
+            # A subclass with its own eval() can't borrow the
+            # handler of its parent.
+            if type(node).eval is not klass.eval:
+                return None
+            return name
+
+    return None
+
+
+class Compiler:
+    """Turn a parsed tree into nested async closures.
+
+    Everything that eval() works out on every run from the parse
+    results - which optional parts are present, service names, literal
+    values, log messages - is worked out here once. The closures still
+    read vars and call the interpreter through the node's context at
+    run time, so they behave exactly like eval().
+
+    Node types without a compile method, or subclasses that override
+    eval(), compile to their own eval().
+    """
+
+    handlers = {
+        Auto: 'compile_auto',
+        Actions: 'compile_actions',
+        CommandBlock: 'compile_block',
+        IfThenElse: 'compile_if',
+        Switch: 'compile_switch',
+        Condition: 'compile_condition',
+        Comparison: 'compile_comparison',
+        Assignment: 'compile_assignment',
+        Command: 'compile_command',
+        Pass: 'compile_pass',
+        Set: 'compile_set',
+        Wait: 'compile_wait',
+        Dim: 'compile_dim',
+        Target: 'compile_target',
+        With: 'compile_with',
+        Dict: 'compile_dict',
+        Input: 'compile_input',
+        Entity: 'compile_entity',
+        Var: 'compile_var',
+        String: 'compile_constant',
+        Number: 'compile_constant'
+    }
+
+    def compile(self, node):
+        """Return an async function that runs like node.eval()"""
+        name = handler(self.handlers, node)
+
+        if name is None:
+            return node.eval
+
+        return getattr(self, name)(node)
+
+    def spanned(self, node):
+        """Compile node into a step that records a span in traced runs"""
+        step = self.compile(node)
+
+        def spanned():
+            if current_span.get() is None:
+                return step()
+            return trace(node, step)
+
+        return spanned
+
+    def compile_auto(self, node):
+        return self.compile(node.actions)
+
+    def compile_actions(self, node):
+        clauses = [self.spanned(clause) for clause in node.clauses]
+
+        async def actions():
+            for clause in clauses:
+                await clause()
+
+        return actions
+
+    def compile_block(self, node):
+        ctx = node.ctx
+        steps = [(f"Executing {str(command)}", command, self.compile(command))
+                 for command in node.commands]
+        commands = [step for _, _, step in steps]
+
+        async def block():
+            if ctx.parallel or ctx.coalesce:
+                return await node.run_batches(commands)
+
+            log = ctx.interpreter.log
+            logging = is_enabled(log, 'info')
+
+            results = []
+            for message, command, step in steps:
+                if logging:
+                    await log.info(message)
+                results.append(await evaluate(command, step))
+            return results
+
+        return block
+
+    def compile_if(self, node):
+        conditions = self.spanned(node.conditions)
+        actions = self.spanned(node.actions)
+
+        if hasattr(node, 'fallback'):
+            fallback = self.spanned(node.fallback)
+        else:
+            fallback = None
+
+        async def if_then_else():
+            if await conditions() is True:
+                return await actions()
+            if fallback is not None:
+                return await fallback()
+            return None
+
+        return if_then_else
+
+    def compile_switch(self, node):
+        ctx = node.ctx
+        cases = [(self.spanned(case[1]), self.spanned(case[2]))
+                 for case in node.cases]
+
+        if hasattr(node, 'fallback'):
+            fallback = self.spanned(node.fallback[-1])
+        else:
+            fallback = None
+
+        async def switch():
+            values = None
+            if ctx.concurrency:
+                values = await ctx.read_states(node.reads())
+
+            for n, (conditions, commands) in enumerate(cases):
+                with ctx.use_states(values):
+                    result = await conditions()
+
+                if result is not False:
+                    await commands()
+                    return n + 1
+
+            if fallback is not None:
+                await fallback()
+                return 0
+
+            return None
+
+        return switch
+
+    def compile_condition(self, node):
+        ctx = node.ctx
+        tree = self.compile_tree(node, node._eval_tree)
+        prefix = f"'{str(node)}' is "
+
+        async def condition():
+            if ctx.concurrency:
+                values = await ctx.read_states(node.reads())
+                with ctx.use_states(values):
+                    result = await tree()
+            else:
+                result = await tree()
+
+            ctx.note_condition(result)
+
+            log = ctx.interpreter.log
+            if is_enabled(log, 'info'):
+                await log.info(
+                    f"{prefix}{result}. "
+                    f"{'Executing' if result else 'Skipping'} commands."
+                )
+            return result
+
+        return condition
+
+    def compile_tree(self, node, tree):
+        opfunc = tree['opfunc']
+        decider = node.deciders[opfunc]
+        items = [item for item in tree['items']
+                 if type(item) in (dict, Comparison)]
+
+        # Each step carries the items it makes redundant when it
+        # settles the result.
+        steps = [(self.compile_tree(node, item) if type(item) == dict
+                  else self.spanned(item),
+                  items[n + 1:])
+                 for n, item in enumerate(items)]
+
+        async def evaluate():
+            statements = []
+            for step, rest in steps:
+                result = await step()
+                statements.append(result)
+                if bool(result) is decider:
+                    node.skipped(rest)
+                    break
+            return opfunc(statements)
+
+        return evaluate
+
+    def compile_comparison(self, node):
+        ctx = node.ctx
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        opfunc = node.opfunc
+        operand = node.operand
+        text = str(node)
+
+        async def comparison():
+            left_value = await left()
+            right_value = await right()
+            result = opfunc(left_value, right_value)
+
+            log = ctx.interpreter.log
+            if is_enabled(log, 'info'):
+                await log.info(
+                    f"Comparison {result}: {text} evaluated to"
+                    f" ({left_value} {operand} {right_value})"
+                )
+            return result
+
+        return comparison
+
+    def compile_assignment(self, node):
+        ctx = node.ctx
+        values = {node.var.name: node._value[0]}
+
+        if node.namespace == 'local':
+            update = ctx.update_vars
+        elif node.namespace == 'global':
+            update = ctx.update_global_vars
+        else:
+            update = None
+
+        async def assignment():
+            if update is not None:
+                update(values)
+
+        return assignment
+
+    def compile_pass(self, node):
+        ctx = node.ctx
+
+        async def pass_():
+            log = ctx.interpreter.log
+            if is_enabled(log, 'debug'):
+                await log.debug("Passing")
+
+        return pass_
+
+    def compile_wait(self, node):
+        # A var's time is only known at run time.
+        if type(node.time) == Var:
+            return node.eval
+
+        ctx = node.ctx
+        seconds = node.time.seconds
+
+        async def wait():
+            return await ctx.interpreter.sleep(seconds)
+
+        return wait
+
+    def compile_set(self, node):
+        ctx = node.ctx
+        value = self.compile(node.new_value)
+        names = self.compile_names(node.targets.contents)
+
+        async def set_():
+            new_value = await value()
+            return await ctx.set_states(names(), value=new_value)
+
+        return set_
+
+    def compile_names(self, items):
+        """Return a function listing the entity names in items"""
+        if all(type(item) == Entity for item in items):
+            names = [item.name for item in items]
+            return lambda: names
+
+        def dynamic():
+            return [(item.fetch() if type(item) == Var else item).name
+                    for item in items]
+
+        return dynamic
+
+    def compile_command(self, node):
+        ctx = node.ctx
+        domain = node.domain
+        service_name = node.service_name
+        parts = self.compile_parts(node)
+
+        async def command():
+            kwargs = await merge({}, parts)
+            return await ctx.call_service(domain,
+                                          service_name,
+                                          **kwargs)
+
+        return command
+
+    def compile_parts(self, node):
+        """Compile the pieces a command merges into its kwargs"""
+        parts = []
+
+        if hasattr(node, 'targets'):
+            parts.append(self.compile(node.targets))
+
+        if hasattr(node, 'with_data'):
+            parts.append(self.compile(node.with_data))
+
+        if hasattr(node, 'static_data'):
+            parts.append(self.compile_static(node.static_data))
+
+        return parts
+
+    def compile_static(self, value):
+        async def static():
+            return value
+
+        return static
+
+    def compile_dim(self, node):
+        ctx = node.ctx
+        domain = node.domain
+        number = self.compile(node.number)
+        param = node.param
+        parts = self.compile_parts(node)
+
+        async def dim():
+            value = await number()
+            service_name = "turn_on" if value > 0 else "turn_off"
+            kwargs = await merge({param: value}, parts)
+            return await ctx.call_service(domain,
+                                          service_name,
+                                          **kwargs)
+
+        return dim
+
+    def compile_target(self, node):
+        resolve = self.resolve_target(node)
+
+        async def target():
+            return resolve()
+
+        return target
+
+    def resolve_target(self, node):
+        """Return a function building the target dict for node"""
+        def resolve():
+            entities, areas = node.ids()
+            return {'entity_id': list(entities), 'area_id': list(areas)}
+
+        return resolve
+
+    def compile_with(self, node):
+        return self.compile(node._value)
+
+    def compile_dict(self, node):
+        if hasattr(node, 'attribute'):
+            return self.compile(node.contents.get(node.attribute))
+
+        # Literals are filled in up front; keys keep their order.
+        template = {}
+        dynamic = []
+
+        for key, value in node.contents.items():
+            if type(value) in (String, Number):
+                template[key] = value._value
+            else:
+                template[key] = None
+                dynamic.append((key, self.compile(value)))
+
+        async def dictionary():
+            result = dict(template)
+            for key, value in dynamic:
+                result[key] = await value()
+            return result
+
+        return dictionary
+
+    def compile_input(self, node):
+        ctx = node.ctx
+        source = node.input
+
+        if type(source) == Var:
+            async def value():
+                return await source.fetch().eval()
+        else:
+            value = self.compile(source)
+
+        if node.result_type != 'numeric':
+            return value
+
+        async def numeric():
+            result = await value()
+            try:
+                return float(result)
+            except ValueError as error:
+                await ctx.log.error(error)
+
+        return numeric
+
+    def compile_entity(self, node):
+        ctx = node.ctx
+        attribute = node.attribute
+
+        if attribute == 'name':
+            return self.compile_static(".".join([node.domain, node.id]))
+        if attribute == 'id':
+            return self.compile_static(node.id)
+        if attribute == 'domain':
+            return self.compile_static(node.domain)
+
+        name = node.name
+        message = f"fetching state of {name}"
+
+        async def entity():
+            if is_enabled(ctx.log, 'info'):
+                await ctx.log.info(message)
+            return await ctx.get_state(name)
+
+        return entity
+
+    def compile_var(self, node):
+        fetch = node.fetch
+
+        if hasattr(node, 'attribute'):
+            attribute = node.attribute
+
+            async def attribute_var():
+                value = fetch()
+                if hasattr(value, 'eval'):
+                    return await value.eval(attribute=attribute)
+                return value.get(attribute)
+
+            return attribute_var
+
+        async def var():
+            value = fetch()
+            if hasattr(value, 'eval'):
+                return await value.eval()
+            return value
+
+        return var
+
+    def compile_constant(self, node):
+        return self.compile_static(node._value)
+
+
+async def merge(kwargs, parts):
+    for part in parts:
+        kwargs.update(await part())
+    return kwargs
+
+
+def compile_auto(auto):
+    """Return an async function that runs auto's actions"""
+    return Compiler().compile(auto)
+
+
+class Assembler:
+    """Lower a parsed tree into a linear vm.Code listing.
+
+    Values live in numbered registers and control flow becomes jumps,
+    so a run is one loop in vm.run() rather than a chain of nested
+    coroutines. Nodes the assembler doesn't know, or subclasses that
+    override eval(), become a single EVAL of their own eval().
+    """
+
+    handlers = {
+        Auto: 'lower_auto',
+        Actions: 'lower_actions',
+        CommandBlock: 'lower_block',
+        IfThenElse: 'lower_if',
+        Switch: 'lower_switch',
+        Condition: 'lower_condition',
+        Comparison: 'lower_comparison',
+        Assignment: 'lower_assignment',
+        Command: 'lower_command',
+        Pass: 'lower_pass',
+        Set: 'lower_set',
+        Wait: 'lower_wait',
+        Dim: 'lower_dim',
+        Target: 'lower_target',
+        With: 'lower_with',
+        Dict: 'lower_dict',
+        Input: 'lower_input',
+        Entity: 'lower_entity',
+        Var: 'lower_var',
+        String: 'lower_constant',
+        Number: 'lower_constant'
+    }
+
+    def __init__(self):
+        self.instructions = []
+        self.registers = 0
+        self.notes = {}
+        self.compiler = Compiler()
+
+    def assemble(self, node):
+        result = self.lower(node)
+        self.emit(vm.RETURN, result)
+        return vm.Code(node.ctx, self.instructions, self.registers, self.notes)
+
+    def lower(self, node):
+        """Emit code for node and return the register holding its value"""
+        name = handler(self.handlers, node)
+
+        if name is None:
+            result = self.register()
+            self.emit(vm.EVAL, result, node.eval)
+            return result
+
+        return getattr(self, name)(node)
+
+    def spanned(self, node):
+        """Lower node between SPAN and END_SPAN, so traced runs record it"""
+        self.emit(vm.SPAN, node)
+        result = self.lower(node)
+        self.emit(vm.END_SPAN)
+        return result
+
+    def register(self):
+        self.registers += 1
+        return self.registers - 1
+
+    def emit(self, *instruction):
+        self.instructions.append(instruction)
+        return len(self.instructions) - 1
+
+    def label(self):
+        return len(self.instructions)
+
+    def patch(self, index):
+        """Point the jump at index to the next instruction"""
+        instruction = self.instructions[index]
+        self.instructions[index] = instruction[:-1] + (self.label(),)
+
+    def const(self, value):
+        result = self.register()
+        self.emit(vm.LOAD_CONST, result, value)
+        return result
+
+    def lower_auto(self, node):
+        return self.lower(node.actions)
+
+    def lower_actions(self, node):
+        for clause in node.clauses:
+            self.spanned(clause)
+
+    def lower_block(self, node):
+        # The inline commands below are the serial path.
+        batched = self.emit(vm.BATCHED, self.compiler.compile(node), None)
+
+        for command in node.commands:
+            message = f"Executing {str(command)}"
+            self.notes[self.label()] = str(command)
+            self.emit(vm.LOG, 'interpreter', 'info', message, ())
+            self.spanned(command)
+
+        self.patch(batched)
+
+    def lower_if(self, node):
+        conditions = self.spanned(node.conditions)
+        skip = self.emit(vm.JUMP_IF_NOT_TRUE, conditions, None)
+        self.spanned(node.actions)
+
+        if hasattr(node, 'fallback'):
+            end = self.emit(vm.JUMP, None)
+            self.patch(skip)
+            self.spanned(node.fallback)
+            self.patch(end)
+        else:
+            self.patch(skip)
+
+    def lower_switch(self, node):
+        ends = []
+        values = self.register()
+        self.emit(vm.READ_STATES, values, node)
+
+        for case in node.cases:
+            self.emit(vm.USE_STATES, values)
+            conditions = self.spanned(case[1])
+            self.emit(vm.RELEASE)
+            skip = self.emit(vm.JUMP_IF_FALSE, conditions, None)
+            self.spanned(case[2])
+            ends.append(self.emit(vm.JUMP, None))
+            self.patch(skip)
+
+        if hasattr(node, 'fallback'):
+            self.spanned(node.fallback[-1])
+
+        for end in ends:
+            self.patch(end)
+
+    def lower_condition(self, node):
+        values = self.register()
+        self.emit(vm.READ_STATES, values, node)
+        self.emit(vm.USE_STATES, values)
+        result = self.lower_tree(node, node._eval_tree)
+        self.emit(vm.RELEASE)
+        self.emit(vm.LOG_RESULT, result, str(node))
+        return result
+
+    def lower_tree(self, node, tree):
+        opfunc = tree['opfunc']
+        decider = node.deciders[opfunc]
+        items = [item for item in tree['items']
+                 if type(item) in (dict, Comparison)]
+        registers = []
+        exits = []
+
+        for n, item in enumerate(items):
+            if type(item) == dict:
+                registers.append(self.lower_tree(node, item))
+            else:
+                registers.append(self.spanned(item))
+
+            rest = tuple(items[n + 1:])
+            if rest:
+                exits.append(self.emit(vm.SHORT_CIRCUIT, registers[-1],
+                                       decider, node, rest, None))
+
+        # Registers of skipped items are still None, which leaves
+        # all, any and negate with the same answer.
+        for index in exits:
+            self.patch(index)
+
+        result = self.register()
+        self.emit(vm.TEST, result, opfunc, tuple(registers))
+        return result
+
+    def lower_comparison(self, node):
+        left = self.lower(node.left)
+        right = self.lower(node.right)
+        result = self.register()
+        self.emit(vm.CMP, result, node.opfunc, left, right)
+
+        template = (f"Comparison {{0}}: {escape(str(node))} evaluated to"
+                    f" ({{1}} {escape(node.operand)} {{2}})")
+        self.emit(vm.LOG, 'interpreter', 'info', template,
+                  (result, left, right))
+        return result
+
+    def lower_assignment(self, node):
+        self.emit(vm.ASSIGN, node.namespace, {node.var.name: node._value[0]})
+
+    def lower_pass(self, node):
+        self.emit(vm.LOG, 'interpreter', 'debug', "Passing", ())
+
+    def lower_wait(self, node):
+        result = self.register()
+        if type(node.time) == Var:
+            self.emit(vm.EVAL, result, node.eval)
+            return result
+
+        self.emit(vm.SLEEP, result, node.time.seconds)
+        return result
+
+    def lower_set(self, node):
+        value = self.lower(node.new_value)
+        names = self.compiler.compile_names(node.targets.contents)
+        result = self.register()
+        self.emit(vm.SET_STATE, result, names, value)
+        return result
+
+    def lower_command(self, node):
+        kwargs = self.register()
+        self.emit(vm.MERGE, kwargs, self.lower_parts(node))
+
+        result = self.register()
+        self.emit(vm.CALL_SERVICE, result, node.domain, node.service_name,
+                  kwargs)
+        return result
+
+    def lower_parts(self, node):
+        parts = []
+
+        if hasattr(node, 'targets'):
+            parts.append(self.lower(node.targets))
+
+        if hasattr(node, 'with_data'):
+            parts.append(self.lower(node.with_data))
+
+        if hasattr(node, 'static_data'):
+            parts.append(self.const(node.static_data))
+
+        return tuple(parts)
+
+    def lower_dim(self, node):
+        number = self.lower(node.number)
+        on = self.register()
+        self.emit(vm.CMP, on, operator.gt, number, self.const(0))
+
+        data = self.register()
+        self.emit(vm.BUILD, data, {node.param: None},
+                  ((node.param, number),))
+
+        kwargs = self.register()
+        self.emit(vm.MERGE, kwargs, (data,) + self.lower_parts(node))
+
+        result = self.register()
+        skip = self.emit(vm.JUMP_IF_NOT_TRUE, on, None)
+        self.emit(vm.CALL_SERVICE, result, node.domain, "turn_on", kwargs)
+        end = self.emit(vm.JUMP, None)
+        self.patch(skip)
+        self.emit(vm.CALL_SERVICE, result, node.domain, "turn_off", kwargs)
+        self.patch(end)
+        return result
+
+    def lower_target(self, node):
+        result = self.register()
+        self.emit(vm.TARGETS, result, self.compiler.resolve_target(node))
+        return result
+
+    def lower_with(self, node):
+        return self.lower(node._value)
+
+    def lower_dict(self, node):
+        if hasattr(node, 'attribute'):
+            return self.lower(node.contents.get(node.attribute))
+
+        template = {}
+        pairs = []
+
+        for key, value in node.contents.items():
+            if type(value) in (String, Number):
+                template[key] = value._value
+            else:
+                template[key] = None
+                pairs.append((key, self.lower(value)))
+
+        result = self.register()
+        self.emit(vm.BUILD, result, template, tuple(pairs))
+        return result
+
+    def lower_input(self, node):
+        source = node.input
+
+        if type(source) == Var:
+            async def fetched():
+                return await source.fetch().eval()
+
+            value = self.register()
+            self.emit(vm.EVAL, value, fetched)
+        else:
+            value = self.lower(source)
+
+        if node.result_type != 'numeric':
+            return value
+
+        result = self.register()
+        self.emit(vm.NUMERIC, result, value)
+        return result
+
+    def lower_entity(self, node):
+        attribute = node.attribute
+
+        if attribute == 'name':
+            return self.const(".".join([node.domain, node.id]))
+        if attribute == 'id':
+            return self.const(node.id)
+        if attribute == 'domain':
+            return self.const(node.domain)
+
+        self.emit(vm.LOG, 'ctx', 'info', f"fetching state of {node.name}", ())
+        result = self.register()
+        self.emit(vm.LOAD_STATE, result, node.name)
+        return result
+
+    def lower_var(self, node):
+        result = self.register()
+        self.emit(vm.LOAD_VAR, result, node, getattr(node, 'attribute', None))
+        return result
+
+    def lower_constant(self, node):
+        return self.const(node._value)
+
+
+def escape(text):
+    """Quote text for use inside a str.format template"""
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def assemble(node):
+    """Lower node (usually an Auto) into vm.Code"""
+    return Assembler().assemble(node)
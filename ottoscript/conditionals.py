@@ -4,17 +4,20 @@ from pyparsing import (
     OneOrMore,
     opAssoc,
     infixNotation,
-    Forward,
     Optional,
     MatchFirst
 )
 from .datatypes import String, Number, Var, Entity
-from .ottobase import OttoBase
+from .ottobase import OttoBase, grammar, recursive_grammar
 from .keywords import IF, AND, OR, NOT, THEN, ELSE, CASE, END, SWITCH, DEFAULT
 from .commands import Command, Assignment
+from .logs import is_enabled
+from .runtime import current_run
+from .tracing import evaluate
 
 
 class Comparison(OttoBase):
+    __slots__ = ('left', 'operand', 'right', 'opfunc')
 
     operators = {
         '==': op.eq,
@@ -25,18 +28,22 @@ class Comparison(OttoBase):
         '>': op.gt
     }
 
-    term = (
-        String()
-        | Number()
-        | Entity()
-        | Var()
-    )
+    @grammar
+    def term(cls):
+        return (
+            String()
+            | Number()
+            | Entity()
+            | Var()
+        )
 
-    parser = Group(
-        term("left")
-        + MatchFirst([x for x in operators.keys()])("operand")
-        + term("right")
-    )
+    @grammar
+    def parser(cls):
+        return Group(
+            cls.term("left")
+            + MatchFirst([x for x in cls.operators.keys()])("operand")
+            + cls.term("right")
+        )
 
     def __init__(self, tokens):
         super().__init__(tokens)
@@ -49,53 +56,288 @@ class Comparison(OttoBase):
         right = await self.right.eval()
         result = self.opfunc(left, right)
 
-        msg = f"Comparison {result}:"
-        msg += f" {str(self)}"
-        msg += f" evaluated to ({left} {self.operand} {right})"
-        await self.ctx.interpreter.log.info(msg)
+        log = self.ctx.interpreter.log
+        if is_enabled(log, 'info'):
+            msg = f"Comparison {result}:"
+            msg += f" {str(self)}"
+            msg += f" evaluated to ({left} {self.operand} {right})"
+            await log.info(msg)
         return result
 
+    def reads(self):
+        """Return the states evaluating this comparison reads"""
+        names = []
+
+        for term in (self.left, self.right):
+            if type(term) == Var:
+                term = term.fetch()
+            if (type(term) == Entity
+                    and term.attribute not in ('name', 'id', 'domain')):
+                names.append(term.name)
+
+        return names
+
+
+def negate(statements):
+    return not all(statements)
+
 
 class Conditional(OttoBase):
-    forward = Forward()
+    __slots__ = ()
+
+    @recursive_grammar
+    def forward(cls):
+        return MatchFirst([IfThenElse(), Switch()])
 
 
 class CommandBlock(OttoBase):
-    parser = Group(
-        Optional(THEN)
-        + OneOrMore(
-            MatchFirst(Command.parsers())
-            | Assignment("local")
-            | Conditional.forward
-        )("commands")
-    )
+    __slots__ = ('commands',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            Optional(THEN)
+            + OneOrMore(
+                MatchFirst(Command.parsers())
+                | Assignment("local")
+                | Conditional.forward
+            )("commands")
+        )
 
     async def eval(self):
+        if self.ctx.parallel or self.ctx.coalesce:
+            return await self.run_batches([c.eval for c in self.commands])
+
+        log = self.ctx.interpreter.log
+        logging = is_enabled(log, 'info')
+
         results = []
         for command in self.commands:
-            await self.ctx.interpreter.log.info(f"Executing {str(command)}")
-            result = await command.eval()
+            if logging:
+                await log.info(f"Executing {str(command)}")
+            result = await evaluate(command)
             results.append(result)
         return results
 
+    async def run_batches(self, steps):
+        """Run steps, one per command, a batch at a time"""
+        log = self.ctx.interpreter.log
+        logging = is_enabled(log, 'info')
+        results = []
+
+        for batch in self.batches():
+            for index in batch:
+                if logging:
+                    await log.info(f"Executing {str(self.commands[index])}")
+
+            results.extend(await self.run_batch(batch, steps))
+
+        return results
+
+    async def run_batch(self, batch, steps):
+        ctx = self.ctx
+
+        merged = []
+        if ctx.coalesce:
+            merged = [i for i in batch if self.coalescable(i)]
+        if len(merged) < 2:
+            merged = []
+
+        rest = [i for i in batch if i not in merged]
+        aws = [evaluate(self.commands[i], steps[i]) for i in rest]
+        if merged:
+            aws.append(self.call_merged([self.commands[i] for i in merged]))
+
+        if len(aws) == 1:
+            outcomes = [await aws[0]]
+        else:
+            outcomes = await ctx.gather(aws)
+
+        results = dict(zip(rest, outcomes))
+        if merged:
+            results.update(zip(merged, outcomes[-1]))
+
+        return [results[i] for i in batch]
+
+    async def call_merged(self, commands):
+        """Make the commands' calls, merging runs of the same call.
+
+        Calls in a row with the same domain, service and data become
+        one call over all of their targets, unless they share a
+        target. Calls on an area could reach any entity in the domain,
+        so they are never merged. Each command gets the result of the
+        call it joined.
+        """
+        calls = []
+
+        for command in commands:
+            domain, service_name, kwargs = await command.call()
+            data = {k: v for k, v in kwargs.items()
+                    if k not in ('entity_id', 'area_id')}
+            entities = as_list(kwargs.get('entity_id', []))
+            areas = as_list(kwargs.get('area_id', []))
+
+            if calls and not areas:
+                key, targets, count = calls[-1]
+                if (key == (domain, service_name, data)
+                        and not targets['area_id']
+                        and targets['entity_id'].keys().isdisjoint(entities)):
+                    targets['entity_id'].update(dict.fromkeys(entities))
+                    calls[-1][2] += 1
+                    continue
+
+            calls.append([(domain, service_name, data),
+                          {'entity_id': dict.fromkeys(entities),
+                           'area_id': dict.fromkeys(areas)},
+                          1])
+
+        saved = len(commands) - len(calls)
+        run = current_run.get()
+        if run is not None:
+            run.coalesced += saved
+        else:
+            self.ctx.counters['coalesced_calls'] += saved
+
+        results = []
+        for (domain, service_name, data), targets, count in calls:
+            result = await self.ctx.call_service(
+                domain, service_name,
+                **{name: list(ids) for name, ids in targets.items()},
+                **data)
+            results.extend([result] * count)
+
+        return results
+
+    def batches(self):
+        """Yield the batches of command indices that run together.
+
+        A batch is only yielded once it is complete, and a command that
+        runs alone as soon as it is reached. Each batch runs before the
+        next is worked out, so targets and inputs are read after any
+        assignment or conditional before them has run.
+        """
+        if self.ctx.parallel:
+            yield from self.parallel_batches()
+            return
+
+        # Otherwise commands that can be merged are grouped while they
+        # run on, and everything else runs alone.
+        batch = None
+
+        for index in range(len(self.commands)):
+            if not self.coalescable(index):
+                if batch is not None:
+                    yield batch
+                    batch = None
+                yield [index]
+            elif batch is not None:
+                batch.append(index)
+            else:
+                batch = [index]
+
+        if batch is not None:
+            yield batch
+
+    def coalescable(self, index):
+        command = self.commands[index]
+        return isinstance(command, Command) and command.coalescable()
+
+    def parallel_batches(self):
+        """Group command indices into runs that are safe to start together.
+
+        Anything but a command with known effects (an assignment, wait
+        or conditional) runs alone. Otherwise a command joins the batch
+        before it unless it reads or writes an entity the batch writes,
+        or writes one the batch reads.
+        """
+        batch = None
+        reads = writes = None
+
+        for index, command in enumerate(self.commands):
+            if isinstance(command, Command):
+                effects = command.effects()
+            else:
+                effects = None
+
+            if effects is None:
+                if batch is not None:
+                    yield batch
+                    batch = None
+                yield [index]
+                continue
+
+            new_reads, new_writes = ({entity_of(name) for name in names}
+                                     for names in effects)
+
+            if (batch is not None
+                    and not overlaps(writes, new_reads | new_writes)
+                    and not overlaps(reads, new_writes)):
+                batch.append(index)
+                reads |= new_reads
+                writes |= new_writes
+            else:
+                if batch is not None:
+                    yield batch
+                batch = [index]
+                reads, writes = new_reads, new_writes
+
+        if batch is not None:
+            yield batch
+
+
+def as_list(ids):
+    if isinstance(ids, str):
+        return [ids]
+    return ids
+
+
+def entity_of(name):
+    """Drop any attribute from a state name"""
+    return ".".join(name.split(".")[:2])
+
+
+def overlaps(names, others):
+    """True if any entity in names could be one of those in others"""
+    for name in names:
+        for other in others:
+            if name == other or name == '*' or other == '*':
+                return True
+            if name.endswith(".*") and other.startswith(name[:-1]):
+                return True
+            if other.endswith(".*") and name.startswith(other[:-1]):
+                return True
+
+    return False
+
 
 class Condition(Conditional):
+    __slots__ = ('conditions', '_eval_tree')
+
     operators = {
         'AND': all,
         'OR': any,
-        'NOT': lambda x: not x
+        'NOT': negate
     }
 
-    parser = Group(
-        infixNotation(
-            Comparison(),
-            [
-                (NOT, 1, opAssoc.RIGHT, ),
-                (AND, 2, opAssoc.LEFT, ),
-                (OR, 2, opAssoc.LEFT, ),
-            ]
-        )("conditions")
-    )
+    # The operand value that settles each operator on its own.
+    deciders = {
+        all: False,
+        any: True,
+        negate: False
+    }
+
+    @grammar
+    def parser(cls):
+        return Group(
+            infixNotation(
+                Comparison(),
+                [
+                    (NOT, 1, opAssoc.RIGHT, ),
+                    (AND, 2, opAssoc.LEFT, ),
+                    (OR, 2, opAssoc.LEFT, ),
+                ]
+            )("conditions")
+        )
 
     def __init__(self, tokens):
         super().__init__(tokens)
@@ -106,34 +348,74 @@ class Condition(Conditional):
 
         self._eval_tree = self.build_evaluator_tree(conditions)
 
-    def __str__(self):
-        return " ".join([str(x) for x in self.tokens])
-
     async def eval(self):
-        result = await self.eval_tree(self._eval_tree)
-        await self.ctx.interpreter.log.info(
-            f"'{str(self)}' is {result}. "
-            + f"{'Executing' if result else 'Skipping'}"
-            + " commands."
-        )
+        if self.ctx.concurrency:
+            values = await self.ctx.read_states(self.reads())
+            with self.ctx.use_states(values):
+                result = await self.eval_tree(self._eval_tree)
+        else:
+            result = await self.eval_tree(self._eval_tree)
+
+        self.ctx.note_condition(result)
+
+        log = self.ctx.interpreter.log
+        if is_enabled(log, 'info'):
+            await log.info(
+                f"'{str(self)}' is {result}. "
+                + f"{'Executing' if result else 'Skipping'}"
+                + " commands."
+            )
         return result
 
     async def eval_tree(self, tree):
+        opfunc = tree['opfunc']
+        decider = self.deciders[opfunc]
         statements = []
-        strings = []
-
-        for item in tree['items']:
 
+        for n, item in enumerate(tree['items']):
             if type(item) == dict:
-                statements.append(await self.eval_tree(item))
-            if type(item) == Comparison:
-                result = await item.eval()
-                statements.append(result)
-                strings.append(f"\n{item}: {result}")
+                result = await self.eval_tree(item)
+            elif type(item) == Comparison:
+                result = await evaluate(item)
+            else:
+                continue
 
-        result = tree['opfunc'](statements)
+            statements.append(result)
 
-        return result
+            # The rest can't change the outcome, so isn't evaluated.
+            if bool(result) is decider:
+                self.skipped(tree['items'][n + 1:])
+                break
+
+        return opfunc(statements)
+
+    def skipped(self, items):
+        """Count the comparisons and state reads short-circuiting saved"""
+        counters = self.ctx.counters
+
+        for item in items:
+            if type(item) == dict:
+                self.skipped(item['items'])
+            elif type(item) == Comparison:
+                counters['skipped_comparisons'] += 1
+                counters['skipped_fetches'] += len([
+                    name for name in item.reads()
+                    if not self.ctx.is_prefetched(name)
+                ])
+
+    def reads(self, tree=None):
+        """Return the states every comparison in the tree reads"""
+        if tree is None:
+            tree = self._eval_tree
+
+        names = []
+        for item in tree['items']:
+            if type(item) == dict:
+                names.extend(self.reads(item))
+            elif type(item) == Comparison:
+                names.extend(item.reads())
+
+        return names
 
     def build_evaluator_tree(self, conditions):
         comparisons = []
@@ -151,64 +433,82 @@ class Condition(Conditional):
 
 
 class IfThenElse(Conditional):
-    parser = Group(
-        IF + Condition()("conditions")
-        + CommandBlock()("actions")
-        + Optional(ELSE + (Conditional.forward("fallback")
-                           | CommandBlock()("fallback")
-                           )
-                   )
-        + END
-    )
+    __slots__ = ('conditions', 'actions', 'fallback')
+
+    @grammar
+    def parser(cls):
+        return Group(
+            IF + Condition()("conditions")
+            + CommandBlock()("actions")
+            + Optional(ELSE + (Conditional.forward("fallback")
+                               | CommandBlock()("fallback")
+                               )
+                       )
+            + END
+        )
 
     async def eval(self):
-        conditions_result = await self.conditions.eval()
+        conditions_result = await evaluate(self.conditions)
 
         result = None
         if conditions_result is True:
-            result = await self.actions.eval()
+            result = await evaluate(self.actions)
         else:
             if hasattr(self, "fallback"):
-                result = await self.fallback.eval()
+                result = await evaluate(self.fallback)
 
         return result
 
 
 class Switch(Conditional):
-    parser = Group(
-        SWITCH
-        + OneOrMore(
-            Group(
-                CASE
-                + Condition()
-                + CommandBlock()
-            )
-        )("cases")
-        + Optional(
-            DEFAULT
-            + (CommandBlock()
-               | Conditional.forward
-               )
-        )("fallback")
-        + END
-    )
+    __slots__ = ('cases', 'fallback')
+
+    @grammar
+    def parser(cls):
+        return Group(
+            SWITCH
+            + OneOrMore(
+                Group(
+                    CASE
+                    + Condition()
+                    + CommandBlock()
+                )
+            )("cases")
+            + Optional(
+                DEFAULT
+                + (CommandBlock()
+                   | Conditional.forward
+                   )
+            )("fallback")
+            + END
+        )
 
     async def eval(self):
         selected = None
+        values = None
+
+        # Read the states of every CASE up front, but run the
+        # commands outside of them so they see fresh state.
+        if self.ctx.concurrency:
+            values = await self.ctx.read_states(self.reads())
 
         for n, case in enumerate(self.cases):
             conditions, commands = case[1:]
-            if await conditions.eval() is not False:
+
+            with self.ctx.use_states(values):
+                result = await evaluate(conditions)
+
+            if result is not False:
                 selected = n + 1
-                await commands.eval()
+                await evaluate(commands)
                 break
 
         if selected is None:
             if hasattr(self, 'fallback'):
-                await self.fallback[-1].eval()
+                await evaluate(self.fallback[-1])
                 selected = 0
 
         return selected
 
-
-Conditional.forward <<= MatchFirst(IfThenElse(), Switch())
+    def reads(self):
+        return [name for case in self.cases for name in case[1].reads()]
@@ -1,24 +1,29 @@
 from pyparsing import (Group, Optional, MatchFirst,
                        Suppress, ZeroOrMore, OneOrMore)
 from .keywords import AUTOMATION, RESTART, WHEN
-from .ottobase import OttoBase
+from .ottobase import OttoBase, grammar
 from .datatypes import ident, Var
 from .commands import Assignment
 from .conditionals import IfThenElse, Switch, CommandBlock
 from .triggers import StateTrigger, TimeTrigger
+from .tracing import evaluate
 
 
 class AutoControls(OttoBase):
-    parser = Group(
-        AUTOMATION
-        + ident("name")
-        + Optional(
-            Var()('_trigger_var')
-        )
-        + Optional(
-            RESTART('restart_option')
+    __slots__ = ('name', '_trigger_var', 'restart_option')
+
+    @grammar
+    def parser(cls):
+        return Group(
+            AUTOMATION
+            + ident("name")
+            + Optional(
+                Var()('_trigger_var')
+            )
+            + Optional(
+                RESTART('restart_option')
+            )
         )
-    )
 
     @property
     def trigger_var(self):
@@ -38,46 +43,64 @@ class AutoControls(OttoBase):
         # Either this is never called or something
         # further down the line is going wrong.
         # But honestly - should this live here?
+        self.activate()
+
+    def activate(self):
         self.ctx.set_name(self.name)
 
 
 class Actions(OttoBase):
-    parser = Group(
-        OneOrMore(
-            IfThenElse()
-            | Switch()
-            | CommandBlock()
-        )("clauses")
-    )
+    __slots__ = ('clauses',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            OneOrMore(
+                IfThenElse()
+                | Switch()
+                | CommandBlock()
+            )("clauses")
+        )
 
     async def eval(self):
         for clause in self.clauses:
-            await clause.eval()
+            await evaluate(clause)
 
 
 class GlobalParser(OttoBase):
-    parser = Group(
-        ZeroOrMore(
-            Assignment("global")
-        )("assignments")
-    )
+    __slots__ = ('assignments',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            ZeroOrMore(
+                Assignment("global")
+            )("assignments")
+        )
 
     def __init__(self, tokens):
         super().__init__(tokens)
+        self.activate()
+
+    def activate(self):
         for a in self.assignments:
             a.exec()
 
 
 class Triggers(OttoBase):
-    parser = Group(
-        OneOrMore(
-            Suppress(WHEN)
-            + MatchFirst(
-                StateTrigger.parsers()
-                + TimeTrigger.parsers()
-            )
-        )("_trigger_list")
-    )
+    __slots__ = ('_trigger_list',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            OneOrMore(
+                Suppress(WHEN)
+                + MatchFirst(
+                    StateTrigger.parsers()
+                    + TimeTrigger.parsers()
+                )
+            )("_trigger_list")
+        )
 
     def as_list(self):
         return [
@@ -88,9 +111,13 @@ class Triggers(OttoBase):
 
 
 class Auto(OttoBase):
-    parser = Group(
-        GlobalParser()("globals")
-        + AutoControls()("controls")
-        + Triggers()("triggers")
-        + Actions()("actions")
-    )
+    __slots__ = ('globals', 'controls', 'triggers', 'actions', 'span')
+
+    @grammar
+    def parser(cls):
+        return Group(
+            GlobalParser()("globals")
+            + AutoControls()("controls")
+            + Triggers()("triggers")
+            + Actions()("actions")
+        )
@@ -11,23 +11,51 @@ from pyparsing import (
     alphanums,
     common
 )
-from .keywords import reserved_words, AREA
-from .ottobase import OttoBase
+from .keywords import RESERVED, AREA
+from .logs import is_enabled
+from .ottobase import OttoBase, grammar, AREA_SHORTCUTS
 
-ident = ~reserved_words + common.identifier
-ident = ident.set_parse_action(lambda x: x[0])
+ident = common.identifier.copy().set_parse_action(lambda x: x[0])
+ident = ident.add_condition(lambda x: x[0].upper() not in RESERVED,
+                            message="reserved word")
 
 
 class Var(OttoBase):
-    parser = Group(
-        Word("@", alphanums + '_')("name")
-        + Optional(":" + common.identifier("attribute"))
-    )
+    __slots__ = ('name', 'attribute', '_folded')
+    caches = ('_folded',)
 
-    def __str__(self):
-        return " ".join([str(x) for x in self.tokens])
+    @grammar
+    def parser(cls):
+        return Group(
+            Word("@", alphanums + '_')("name")
+            + Optional(":" + common.identifier("attribute"))
+        )
 
     def fetch(self):
+        ctx = self.ctx
+
+        try:
+            bindings, value = self._folded
+        except AttributeError:
+            pass
+        else:
+            if bindings == ctx.bindings:
+                return value
+
+        value = self.lookup()
+
+        # Globals can't change without bumping ctx.bindings,
+        # so their value is kept until they do.
+        if ctx.is_constant(self.name):
+            self._folded = (ctx.bindings, value)
+
+        return value
+
+    def fold(self):
+        super().fold()
+        self.fetch()
+
+    def lookup(self):
         value = self.ctx.get_var(self.name)
 
         #
@@ -56,25 +84,35 @@ class Var(OttoBase):
 
 
 class String(OttoBase):
-    parser = Group(QuotedString(quote_char="'", unquoteResults=True)("_value")
-                   | QuotedString(quote_char='"',
-                                  unquoteResults=True)("_value")
-                   )
+    __slots__ = ('_value',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            QuotedString(quote_char="'", unquoteResults=True)("_value")
+            | QuotedString(quote_char='"', unquoteResults=True)("_value")
+        )
 
 
 class Number(OttoBase):
-    parser = Group(common.number("_value"))
+    __slots__ = ('_value',)
+
+    @grammar
+    def parser(cls):
+        return Group(common.number("_value"))
 
 
 class Entity(OttoBase):
-    parser = Group(ident("domain")
-                   + Literal(".")
-                   + ident("id")
-                   + Optional(":" + common.identifier("_attribute"))
-                   )
+    __slots__ = ('domain', 'id', '_attribute')
+    separator = ""
 
-    def __str__(self):
-        return "".join([str(x) for x in self.tokens])
+    @grammar
+    def parser(cls):
+        return Group(ident("domain")
+                     + Literal(".")
+                     + ident("id")
+                     + Optional(":" + common.identifier("_attribute"))
+                     )
 
     @property
     def attribute(self):
@@ -114,21 +152,26 @@ class Entity(OttoBase):
         else:
             name = self.name
 
-        await self.ctx.log.info(f"fetching state of {name}")
-        return await self.ctx.interpreter.get_state(name)
+        if is_enabled(self.ctx.log, 'info'):
+            await self.ctx.log.info(f"fetching state of {name}")
+        return await self.ctx.get_state(name)
 
 
 class Area(OttoBase):
-    parser = Group(ident("name"))
+    __slots__ = ('name',)
+
+    @grammar
+    def parser(cls):
+        return Group(ident("name"))
 
 
 class List(OttoBase):
+    __slots__ = ('contents',)
 
-    def __str__(self):
-        return "".join([str(x) for x in self.tokens])
+    separator = ""
 
     @classmethod
-    def pre_parse(cls, content_parser=None, *args, **kwargs):
+    def build_parser(cls, content_parser=None, *args, **kwargs):
 
         if content_parser is None:
             content_parser = (String() ^ Number() ^ Entity() ^ Var())
@@ -140,23 +183,26 @@ class List(OttoBase):
                        + Optional(")")
                        )
         parser.set_name(cls.__name__)
-        return parser.set_parse_action(lambda x: cls(x, *args, **kwargs))
+        return cls.attach(parser, *args, **kwargs)
 
 
 class Dict(OttoBase):
-    _allowedvalues = (String()
-                      | Number()
-                      | Entity()
-                      | Var()
-                      )
-    _attr_label = Word(alphas + '_', alphanums + '_')
-    _attrvalue = Suppress("=") + _allowedvalues + Optional(Suppress(","))
-    _dict = dict_of(_attr_label, _attrvalue)
-    parser = Group(Literal("(")
-                   + _dict("contents")
-                   + Literal(")")
-                   + Optional(Suppress(":") + ident("attribute"))
-                   )
+    __slots__ = ('contents', 'attribute')
+
+    @grammar
+    def parser(cls):
+        allowedvalues = (String()
+                         | Number()
+                         | Entity()
+                         | Var()
+                         )
+        attr_label = Word(alphas + '_', alphanums + '_')
+        attrvalue = Suppress("=") + allowedvalues + Optional(Suppress(","))
+        return Group(Literal("(")
+                     + dict_of(attr_label, attrvalue)("contents")
+                     + Literal(")")
+                     + Optional(Suppress(":") + ident("attribute"))
+                     )
 
     async def eval(self, attribute=None):
         if attribute is not None:
@@ -171,17 +217,61 @@ class Dict(OttoBase):
 
 
 class Target(OttoBase):
-    parser = Group(
-        List(Entity() ^ Var())("inputs")
-        ^ (AREA + List(Area() ^ Var())("inputs"))
-    )
+    __slots__ = ('inputs', '_frozen')
+    caches = ('_frozen',)
+
+    @grammar
+    def parser(cls):
+        return Group(
+            List(Entity() ^ Var())("inputs")
+            ^ (AREA + List(Area() ^ Var())("inputs"))
+        )
 
     async def eval(self):
+        entities, areas = self.ids()
+        return {'entity_id': list(entities), 'area_id': list(areas)}
+
+    def ids(self):
+        """Return (entity ids, area ids) as tuples.
+
+        When every var involved is constant the result is kept
+        until ctx.bindings changes.
+        """
+        bindings = self.ctx.bindings
+
+        try:
+            frozen_at, ids = self._frozen
+        except AttributeError:
+            frozen_at, ids = None, None
+
+        if frozen_at == bindings and ids is not None:
+            return ids
+
+        entities, areas, names = self.collect()
+        ids = (tuple(entities), tuple(areas))
+
+        # A target seen to be dynamic stays so until the next change.
+        if frozen_at != bindings:
+            if all(self.ctx.is_constant(name) for name in names):
+                self._frozen = (bindings, ids)
+            else:
+                self._frozen = (bindings, None)
+
+        return ids
+
+    def fold(self):
+        super().fold()
+        self.ids()
+
+    def collect(self):
+        """Return the entity names, area names and var names involved"""
         entities = []
         areas = []
+        names = set()
 
         for i in self.inputs.contents:
             if type(i) == Var:
+                names.add(i.name)
                 i = i.fetch()
 
             if type(i) == List:
@@ -190,31 +280,23 @@ class Target(OttoBase):
                 i = [i]
             for x in i:
                 if type(x) == Var:
+                    names.add(x.name)
                     x = x.fetch()
                 if type(x) == Entity:
                     entities.append(x.name)
                 if type(x) == Area:
+                    names.add(AREA_SHORTCUTS)
                     expanded = self.expand_areas(x.name)
                     areas.extend(expanded)
 
-        return {'entity_id': entities, 'area_id': areas}
+        return entities, areas, names
 
     def expand_areas(self, name):
-        area_shortcuts = self.ctx.get_var('area_shortcuts')
-        if area_shortcuts is None:
-            return [name]
-
-        if name not in area_shortcuts.keys():
-            return [name]
-
-        areas = []
-        for new in area_shortcuts[name]:
-            areas.extend(self.expand_areas(new))
-
-        return areas
+        return list(self.ctx.areas.expand(name))
 
 
 class Input(OttoBase):
+    __slots__ = ('input', 'result_type')
 
     def __init__(self, tokens, result_type):
         super().__init__(tokens)
@@ -233,12 +315,12 @@ class Input(OttoBase):
                 result = float(result)
                 return result
             except ValueError as error:
-                self.ctx.log.error(error)
+                await self.ctx.log.error(error)
         else:
             return result
 
     @classmethod
-    def pre_parse(cls, result_type, *args, **kwargs):
+    def build_parser(cls, result_type, *args, **kwargs):
         if result_type == "numeric":
             parser = Group(Number()("input")
                            | Entity()("input")
@@ -257,5 +339,4 @@ class Input(OttoBase):
                            )
 
         parser.set_name(cls.__name__)
-        parser.set_parse_action(lambda x: cls(x, result_type, *args, **kwargs))
-        return parser
+        return cls.attach(parser, result_type, *args, **kwargs)
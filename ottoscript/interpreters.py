@@ -1,3 +1,6 @@
+import asyncio
+from .logs import is_enabled, log_lazy
+
 
 pyscript_registry = {}
 
@@ -25,6 +28,9 @@ class PrintLogger:
         if self.debug_as_info:
             print(f'DEBUG: {self.log_id}  {self.task} {message}')
 
+    def is_enabled(self, level):
+        return level != 'debug' or self.debug_as_info
+
 
 class Service:
 
@@ -88,11 +94,17 @@ class Registrar:
             }
         )
 
+        # Resolve vars that only globals feed once, up front.
+        actions.resolve()
+
+        if actions.ctx.metrics is not None:
+            actions.ctx.metrics.automation(key)
+
         if key not in pyscript_registry:
             pyscript_registry.update({key: []})
 
         for trigger in triggers.as_list():
-            await self.log.debug(trigger)
+            await log_lazy(self.log, 'debug', "{}", trigger)
 
             if trigger['type'] == 'state':
                 func = state_trigger_factory(
@@ -113,12 +125,21 @@ class Registrar:
 
             pyscript_registry[key].append(func)
 
+    async def remove(self, namespace, name):
+        key = (namespace, name)
+        await log_lazy(self.log, 'debug', "Removing {}", key)
+
+        self.registry.get(namespace, {}).pop(name, None)
+        pyscript_registry.pop(key, None)
+
     async def eval(self, key, kwargs):
         controls = self.registry[key[0]][key[1]]['controls']
         actions = self.registry[key[0]][key[1]]['actions']
-        await self.log.info(f"Running {controls.name}")
+        await log_lazy(self.log, 'info', "Running {}", controls.name)
         actions.ctx.update_vars(kwargs)
-        await actions.eval()
+
+        with actions.ctx.run(key):
+            await actions.eval()
 
 
 def state_trigger_factory(registrar, key, controls, string, hold):
@@ -187,24 +208,50 @@ class Interpreter:
     async def set_state(self, entity_name, value=None,
                         new_attributes=None, kwargs=None):
 
-        message = f"state.set(entity_name={entity_name},"
-        message += f" value={value},"
-        message += f" new_attributes={new_attributes},"
-        message += f" kwargs = **{kwargs})"
+        if is_enabled(self.log, 'debug'):
+            message = f"state.set(entity_name={entity_name},"
+            message += f" value={value},"
+            message += f" new_attributes={new_attributes},"
+            message += f" kwargs = **{kwargs})"
 
-        await self.log.debug(message)
+            await self.log.debug(message)
 
         return state.set(entity_name, value, new_attributes, kwargs)
 
+    async def set_states(self, entity_names, value=None,
+                         new_attributes=None, kwargs=None):
+        """Set every entity in entity_names, returning results in order.
+
+        Backends that can write many states at once should override
+        this; by default the writes are made concurrently with
+        set_state.
+        """
+        return await asyncio.gather(*[
+            self.set_state(name, value=value,
+                           new_attributes=new_attributes, kwargs=kwargs)
+            for name in entity_names
+        ])
+
     async def get_state(self, entity_name):
-        await self.log.debug(f"Getting State of {entity_name}")
+        await log_lazy(self.log, 'debug', "Getting State of {}", entity_name)
         return state.get(entity_name)
 
+    async def get_states(self, entity_names):
+        """Return {name: state} for every name in entity_names.
+
+        Backends that can read many states at once should override
+        this; by default the reads are made concurrently with get_state.
+        """
+        values = await asyncio.gather(*[
+            self.get_state(name) for name in entity_names
+        ])
+        return dict(zip(entity_names, values))
+
     async def call_service(self, domain, service_name, **kwargs):
-        message = f"service.call({domain}, {service_name}, **{kwargs}))"
-        await self.log.debug(message)
+        await log_lazy(self.log, 'debug', "service.call({}, {}, **{}))",
+                       domain, service_name, kwargs)
         return service.call(domain, service_name, **kwargs)
 
     async def sleep(self, seconds):
-        await self.log.debug(f"task.sleep({seconds}))")
+        await log_lazy(self.log, 'debug', "task.sleep({}))", seconds)
         return task.sleep(seconds)
@@ -1,4 +1,4 @@
-from pyparsing import CaselessKeyword, MatchFirst
+from pyparsing import CaselessKeyword, Keyword, MatchFirst
 
 # control keywords
 AUTOMATION = MatchFirst(map(CaselessKeyword, ["AUTOMATION", "AUTO"]))
@@ -42,3 +42,23 @@ reserved_words = (WHEN | IF | THEN | ELSE | CASE | END
                   | FROM | IS | FOR | TRUE | CHANGES | TO | FROM | ON | OFF
                   | HOUR | MINUTE | SECOND | SUNRISE | SUNSET | BEFORE | AFTER
                   | AREA)
+
+
+def keyword_set(expr):
+    """Collect the upper-cased words matched by a tree of keywords"""
+    words = set()
+    stack = [expr]
+
+    while stack:
+        element = stack.pop()
+        if isinstance(element, Keyword):
+            words.add(element.match.upper())
+        else:
+            stack.extend(element.recurse())
+
+    return frozenset(words)
+
+
+# Checked with a single set lookup instead of trying
+# every keyword in reserved_words in turn.
+RESERVED = keyword_set(reserved_words)
@@ -0,0 +1,148 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from .cache import CompiledCache
+from .controls import Auto
+from .ottobase import OttoBase
+from .program import Program
+
+
+class LoadReport:
+    """Names of the automations touched by one load"""
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.unchanged = []
+
+    def as_dict(self):
+        return {
+            'added': self.added,
+            'changed': self.changed,
+            'removed': self.removed,
+            'unchanged': self.unchanged
+        }
+
+
+class IncrementalLoader:
+    """Load a .otto file into a Registrar, reparsing only edited blocks.
+
+    Blocks are identified by a hash of their source. A block whose hash
+    was seen on the previous load keeps its Auto and its registration;
+    everything else is parsed and registered again. If any block fails
+    to parse, load raises before anything is registered or removed.
+    """
+
+    def __init__(self, registrar, cache=None, packrat=None):
+        self.registrar = registrar
+        self.cache = cache
+        self.packrat = packrat
+        self.blocks = {}
+
+    @property
+    def autos(self):
+        return list(self.blocks.values())
+
+    async def load(self, source):
+        report = LoadReport()
+        previous = self.blocks
+        previous_names = {
+            auto.controls.name: auto for auto in previous.values()
+        }
+        blocks = {}
+        parsed = []
+
+        # Every new or edited block is parsed before the registry is
+        # touched, so a block that fails to parse leaves the previous
+        # load in place.
+        for start, end, text in Program(source).blocks():
+            # Surrounding whitespace depends on the neighbouring
+            # blocks, so it isn't part of the identity.
+            text = text.strip()
+            digest = CompiledCache.key(text)
+            auto = previous.get(digest)
+            new = auto is None
+
+            if new:
+                auto = self.parse(text)
+
+            parsed.append((digest, auto, (start, end), new))
+
+        for digest, auto, span, new in parsed:
+            if not new:
+                report.unchanged.append(auto.controls.name)
+            else:
+                name = auto.controls.name
+
+                if name in previous_names:
+                    await self.unregister(previous_names[name])
+                    report.changed.append(name)
+                else:
+                    report.added.append(name)
+
+                await self.registrar.add(auto.controls,
+                                         auto.triggers,
+                                         auto.actions)
+
+            auto.span = span
+            blocks[digest] = auto
+
+        names = {auto.controls.name for auto in blocks.values()}
+        for name, auto in previous_names.items():
+            if name not in names:
+                await self.unregister(auto)
+                report.removed.append(name)
+
+        self.blocks = blocks
+        return report
+
+    def parse(self, text):
+        if self.cache is not None:
+            return self.cache.load(text, parse_all=True)
+
+        return Auto.parse(text, packrat=self.packrat, parse_all=True)
+
+    async def unregister(self, auto):
+        namespace = auto.controls.ctx.log.log_id
+        await self.registrar.remove(namespace, auto.controls.name)
+
+
+def parse_file(path, packrat=None):
+    """Parse every automation in a file, for use in a worker process"""
+    if not hasattr(OttoBase, 'context'):
+        OttoBase.set_context()
+
+    return list(Program(Path(path), packrat=packrat))
+
+
+def load_files(paths, context=None, max_workers=None, packrat=None):
+    """Parse many .otto files in a process pool.
+
+    Returns a dict of path to a list of Auto trees. Trees come back from
+    the workers without a context and are bound to context, which may be
+    an OttoContext shared by every file or a callable taking the path and
+    returning one. It defaults to the class-level context.
+    """
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            path: pool.submit(parse_file, path, packrat)
+            for path in paths
+        }
+
+        for path, future in futures.items():
+            if context is None:
+                ctx = OttoBase.context
+            elif callable(context):
+                ctx = context(path)
+            else:
+                ctx = context
+
+            autos = future.result()
+            for auto in autos:
+                auto.bind(ctx)
+
+            results[path] = autos
+
+    return results
@@ -0,0 +1,207 @@
+"""Level checks for ottoscript loggers.
+
+Loggers are duck-typed: anything with set_task and async info, error,
+warning and debug methods will do. A logger can also have a synchronous
+is_enabled(level) so callers can skip building messages nobody will
+see; without one, every level is taken to be on.
+
+QueueLogger is a logger for production use: its methods only queue a
+line, and a LogBuffer writes the lines out in batches from a
+background task.
+"""
+import asyncio
+import inspect
+import time
+from collections import deque
+from .runtime import current_run
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+
+def is_enabled(log, level):
+    """True if log outputs messages at level"""
+    check = getattr(log, 'is_enabled', None)
+    return check is None or check(level)
+
+
+async def log_lazy(log, level, message, *args):
+    """Log message.format(*args) at level, formatting only if enabled"""
+    if is_enabled(log, level):
+        if args:
+            message = message.format(*args)
+        await getattr(log, level)(message)
+
+
+class LogBuffer:
+    """Bounded queue of log lines, written out in batches.
+
+    Lines are only appended by callers; a background task started on
+    the first line drains them to sink in batches of up to batch_size.
+    sink is a file path, an object with write(), or a function taking
+    a list of lines, which may be async. When the buffer is full the
+    oldest line is dropped. A batch the sink raises on is lost and
+    counted in errors, and writing carries on with the next.
+    """
+
+    def __init__(self, sink, capacity=1000, batch_size=100):
+        self.sink = sink
+        self.lines = deque(maxlen=capacity)
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self.last_error = None
+        self.file = None
+        self.task = None
+        self.ready = None
+        self.closed = False
+
+    def put(self, line):
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(line)
+
+        loop = asyncio.get_running_loop()
+        if (self.task is None or self.task.done()
+                or self.task.get_loop() is not loop):
+            self.closed = False
+            self.ready = asyncio.Event()
+            self.task = loop.create_task(self.drain())
+        self.ready.set()
+
+    async def drain(self):
+        while not self.closed or self.lines:
+            await self.ready.wait()
+            self.ready.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write every buffered line"""
+        while self.lines:
+            count = min(self.batch_size, len(self.lines))
+            batch = [self.lines.popleft() for _ in range(count)]
+            try:
+                await self.write(batch)
+            except Exception as error:
+                self.errors += 1
+                self.last_error = error
+            else:
+                self.written += count
+
+    async def write(self, batch):
+        sink = self.sink
+
+        if isinstance(sink, str) or hasattr(sink, 'write'):
+            # File writes can block, so they happen off the loop.
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.write_file, batch)
+            return
+
+        result = sink(batch)
+        if inspect.isawaitable(result):
+            await result
+
+    def write_file(self, batch):
+        if self.file is None:
+            if isinstance(self.sink, str):
+                self.file = open(self.sink, 'a')
+            else:
+                self.file = self.sink
+
+        self.file.write("".join(f"{line}\n" for line in batch))
+        self.file.flush()
+
+    async def close(self):
+        """Write what is left and stop the background task"""
+        if self.task is not None:
+            self.closed = True
+            self.ready.set()
+            await self.task
+            self.task = None
+
+        await self.flush()
+
+        if self.file is not None and isinstance(self.sink, str):
+            self.file.close()
+            self.file = None
+
+
+class QueueLogger:
+    """Logger that queues lines on a LogBuffer instead of printing them.
+
+    Loggers for different automations can share one buffer. Each
+    automation may log up to rate lines a second, in bursts of up to
+    burst, and lines past that are dropped; the next line that gets
+    through says how many were. Lines are put down to the automation
+    whose run is in progress, or the task set with set_task outside
+    of one.
+    """
+
+    def __init__(self, buffer, log_id='otto', task=None, level='info',
+                 rate=None, burst=None, clock=time.monotonic):
+        self.buffer = buffer
+        self.log_id = log_id
+        self.task = task
+        self.level = LEVELS[level]
+        self.rate = rate
+        self.burst = burst or rate
+        self.clock = clock
+
+        # Per automation: (tokens left, when they were counted,
+        # lines dropped)
+        self.buckets = {}
+
+    def set_task(self, task):
+        self.task = task
+
+    def is_enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    def source(self):
+        """Return the automation the current line belongs to"""
+        run = current_run.get()
+
+        if run is None or run.name is None:
+            return self.task
+
+        # Registrar runs automations under (namespace, name).
+        if isinstance(run.name, tuple):
+            return run.name[-1]
+
+        return run.name
+
+    def emit(self, level, message):
+        if not self.is_enabled(level):
+            return
+
+        task = self.source()
+
+        dropped = 0
+        if self.rate is not None:
+            now = self.clock()
+            tokens, then, dropped = self.buckets.get(
+                task, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - then) * self.rate)
+
+            if tokens < 1:
+                self.buckets[task] = (tokens, now, dropped + 1)
+                return
+
+            self.buckets[task] = (tokens - 1, now, 0)
+
+        prefix = f"{self.log_id} {task}"
+        if dropped:
+            self.buffer.put(f"WARNING: {prefix} dropped {dropped} lines")
+        self.buffer.put(f"{level.upper()}: {prefix} {message}")
+
+    async def info(self, message):
+        self.emit('info', message)
+
+    async def error(self, message):
+        self.emit('error', message)
+
+    async def warning(self, message):
+        self.emit('warning', message)
+
+    async def debug(self, message):
+        self.emit('debug', message)
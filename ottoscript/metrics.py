@@ -0,0 +1,202 @@
+"""Counters and latency histograms for automation runs.
+
+A MetricsRegistry set as OttoContext(metrics=...) keeps one
+AutomationMetrics per automation key - the (namespace, name) pair
+Registrar runs automations under. Named runs count as started,
+finished or failed and time themselves; inside them the backend calls
+made through the context and the results of conditions are counted
+too. Everything is kept in fixed-size structures allocated when an
+automation is first seen, and exports as a dict or Prometheus text.
+"""
+from bisect import bisect_left
+from time import perf_counter
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Backend calls timed per automation. Bulk writes count as set_state.
+CALLS = ('get_state', 'set_state', 'call_service')
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        # One count per bucket, and a last one for +Inf.
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return (upper bound, observations at or below it) pairs"""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def as_dict(self):
+        return {
+            'buckets': {format_bound(bound): count
+                        for bound, count in self.cumulative()},
+            'sum': self.sum,
+            'count': self.count
+        }
+
+
+class AutomationMetrics:
+    __slots__ = ('key', 'started', 'finished', 'failed', 'run_seconds',
+                 'calls', 'call_seconds', 'conditions')
+
+    def __init__(self, key, buckets=DEFAULT_BUCKETS):
+        self.key = key
+        self.started = 0
+        self.finished = 0
+        self.failed = 0
+        self.run_seconds = Histogram(buckets)
+        self.calls = dict.fromkeys(CALLS, 0)
+        self.call_seconds = {call: Histogram(buckets) for call in CALLS}
+
+        # Conditions evaluated to [False, True].
+        self.conditions = [0, 0]
+
+    async def time_call(self, call, aw):
+        """Await the backend call aw, counting and timing it"""
+        start = perf_counter()
+        try:
+            return await aw
+        finally:
+            self.calls[call] += 1
+            self.call_seconds[call].observe(perf_counter() - start)
+
+    def condition(self, result):
+        self.conditions[result is True] += 1
+
+    @property
+    def labels(self):
+        if isinstance(self.key, tuple) and len(self.key) == 2:
+            namespace, name = self.key
+        else:
+            namespace, name = "", self.key
+        return {'namespace': str(namespace), 'name': str(name)}
+
+    def as_dict(self):
+        false, true = self.conditions
+        checked = false + true
+
+        return {
+            'runs': {'started': self.started,
+                     'finished': self.finished,
+                     'failed': self.failed},
+            'run_seconds': self.run_seconds.as_dict(),
+            'calls': dict(self.calls),
+            'call_seconds': {call: histogram.as_dict()
+                             for call, histogram in self.call_seconds.items()},
+            'conditions': {'true': true,
+                           'false': false,
+                           'true_ratio': true / checked if checked else None}
+        }
+
+
+class MetricsRegistry:
+    """AutomationMetrics for every automation key seen"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='ottoscript'):
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self.automations = {}
+
+    def automation(self, key):
+        metrics = self.automations.get(key)
+
+        if metrics is None:
+            metrics = AutomationMetrics(key, self.buckets)
+            self.automations[key] = metrics
+
+        return metrics
+
+    def as_dict(self):
+        return {key: metrics.as_dict()
+                for key, metrics in self.automations.items()}
+
+    def to_prometheus(self):
+        """Return every metric in the Prometheus text exposition format"""
+        p = self.prefix
+        lines = []
+        automations = list(self.automations.values())
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{format_labels(labels)}"
+                             f" {format_value(value)}")
+
+        for field, help_text in (('started', "Automation runs started."),
+                                 ('finished', "Automation runs finished."),
+                                 ('failed', "Automation runs that raised.")):
+            family(f"{p}_runs_{field}_total", 'counter', help_text,
+                   [("", m.labels, getattr(m, field)) for m in automations])
+
+        family(f"{p}_run_seconds", 'histogram',
+               "Automation run latency in seconds.",
+               [sample for m in automations
+                for sample in histogram_samples(m.run_seconds, m.labels)])
+
+        family(f"{p}_backend_calls_total", 'counter',
+               "Backend calls made by automation runs.",
+               [("", {**m.labels, 'call': call}, count)
+                for m in automations for call, count in m.calls.items()])
+
+        family(f"{p}_backend_call_seconds", 'histogram',
+               "Backend call latency in seconds.",
+               [sample for m in automations
+                for call, histogram in m.call_seconds.items()
+                for sample in histogram_samples(
+                    histogram, {**m.labels, 'call': call})])
+
+        family(f"{p}_conditions_total", 'counter',
+               "Conditions evaluated, by result.",
+               [("", {**m.labels, 'result': result}, m.conditions[index])
+                for m in automations
+                for index, result in ((1, 'true'), (0, 'false'))])
+
+        return "\n".join(lines) + "\n"
+
+
+def histogram_samples(histogram, labels):
+    for bound, count in histogram.cumulative():
+        yield "_bucket", {**labels, 'le': format_bound(bound)}, count
+    yield "_sum", labels, histogram.sum
+    yield "_count", labels, histogram.count
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float('inf') else repr(float(bound))
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    def escape(value):
+        return (value.replace("\\", "\\\\")
+                     .replace("\n", "\\n")
+                     .replace('"', '\\"'))
+
+    pairs = ",".join(f'{k}="{escape(v)}"' for k, v in labels.items())
+    return "{" + pairs + "}"
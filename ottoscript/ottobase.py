@@ -1,5 +1,162 @@
-from pyparsing import ParseResults, CaselessKeyword
+import asyncio
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from pyparsing import (ParseResults, ParserElement, CaselessKeyword,
+                       Empty, Forward)
 from .interpreters import Interpreter, PrintLogger
+from .runtime import RunState, current_run
+from .tracing import count, current_span
+
+
+class GrammarRegistry:
+    """Build each (class, args) parser once and hand out the same object"""
+
+    def __init__(self):
+        self.parsers = {}
+        self.builds = Counter()
+        self.hits = 0
+        self.build_time = 0.0
+        self._depth = 0
+
+    def get(self, cls, *args, **kwargs):
+        key = (cls, args, tuple(sorted(kwargs.items())))
+
+        try:
+            parser = self.parsers.get(key)
+        except TypeError:
+            # Unhashable arguments can't be keyed, so build every time.
+            return self.build(cls, *args, **kwargs)
+
+        if parser is None:
+            # Recursive grammars can build the same key again while
+            # the first build is in progress; keep whichever finished first.
+            parser = self.build(cls, *args, **kwargs)
+            parser = self.parsers.setdefault(key, parser)
+        else:
+            self.hits += 1
+
+        return parser
+
+    def build(self, cls, *args, **kwargs):
+        return self.timed(cls.__name__, cls.build_parser, *args, **kwargs)
+
+    def timed(self, label, build, *args, **kwargs):
+        start = perf_counter()
+        self._depth += 1
+
+        try:
+            return build(*args, **kwargs)
+        finally:
+            self._depth -= 1
+            self.builds[label] += 1
+
+            # Nested builds are already inside the outer timing.
+            if self._depth == 0:
+                self.build_time += perf_counter() - start
+
+    def count_elements(self):
+        seen = set()
+        stack = list(self.parsers.values())
+
+        while stack:
+            element = stack.pop()
+            if id(element) in seen:
+                continue
+            seen.add(id(element))
+            stack.extend(element.recurse())
+
+        return len(seen)
+
+    def stats(self):
+        return {
+            'parsers': len(self.parsers),
+            'elements': self.count_elements(),
+            'builds': sum(self.builds.values()),
+            'hits': self.hits,
+            'build_time': self.build_time,
+            'builds_by_class': dict(self.builds)
+        }
+
+    def clear(self):
+        self.parsers.clear()
+        self.builds.clear()
+        self.hits = 0
+        self.build_time = 0.0
+
+
+grammar_registry = GrammarRegistry()
+
+
+class grammar:
+    """Class attribute built by the decorated function on first access.
+
+    Keeps grammar construction out of import time. The function is
+    called with the class it was defined on.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.parser = None
+
+    def __set_name__(self, owner, name):
+        self.owner = owner
+        self.label = f"{owner.__name__}.{name}"
+
+    def __get__(self, obj, cls=None):
+        if self.parser is None:
+            parser = grammar_registry.timed(self.label,
+                                            self.build,
+                                            self.owner)
+            if self.parser is None:
+                self.parser = parser
+
+        return self.parser
+
+
+class recursive_grammar(grammar):
+    """A grammar that can refer back to itself while it is being built"""
+
+    def __get__(self, obj, cls=None):
+        if self.parser is None:
+            self.parser = Forward()
+            self.parser <<= grammar_registry.timed(self.label,
+                                                   self.build,
+                                                   self.owner)
+
+        return self.parser
+
+
+DEFAULT_PACKRAT_SIZE = 128
+
+
+@contextmanager
+def packrat_mode(cache_size_limit=DEFAULT_PACKRAT_SIZE):
+    """Enable bounded packrat caching for parses run inside the block.
+
+    pyparsing keeps a single process-wide cache, so an outer block that
+    already enabled packrat is left untouched.
+    """
+    if ParserElement._packratEnabled:
+        yield
+        return
+
+    ParserElement.enable_packrat(cache_size_limit)
+    try:
+        yield
+    finally:
+        ParserElement.disable_memoization()
+
+
+def packrat_stats():
+    hits, misses = ParserElement.packrat_cache_stats
+    return {
+        'enabled': ParserElement._packratEnabled,
+        'hits': hits,
+        'misses': misses,
+        'size': getattr(ParserElement.packrat_cache, 'size', None)
+    }
 
 
 class VarHandler:
@@ -22,12 +179,113 @@ class VarHandler:
         self.external.update(dictionary)
 
 
+AREA_SHORTCUTS = 'area_shortcuts'
+
+# States read ahead of evaluation, visible only to the task that read
+# them. Contexts are shared between automations, so this can't live
+# on the OttoContext itself.
+prefetched_states = ContextVar('prefetched_states', default=None)
+
+
+class AreaIndex:
+    """area_shortcuts with every shortcut expanded once, up front.
+
+    expand() gives the same areas, in the same order, as following
+    the shortcuts recursively. Shortcuts that lead back to themselves
+    are rejected with a ValueError.
+    """
+
+    def __init__(self, shortcuts=None):
+        self.shortcuts = shortcuts
+        self.expanded = {}
+
+        if shortcuts is not None:
+            for name in shortcuts.keys():
+                self.build(name, [])
+
+    def build(self, name, path):
+        expanded = self.expanded.get(name)
+        if expanded is not None:
+            return expanded
+
+        if name not in self.shortcuts.keys():
+            return (name,)
+
+        if name in path:
+            cycle = path[path.index(name):] + [name]
+            raise ValueError("area_shortcuts has a cycle: "
+                             + " -> ".join(cycle))
+
+        path.append(name)
+        areas = []
+        for new in self.shortcuts[name]:
+            areas.extend(self.build(new, path))
+        path.pop()
+
+        expanded = self.expanded[name] = tuple(areas)
+        return expanded
+
+    def expand(self, name):
+        return self.expanded.get(name, (name,))
+
+
 class OttoContext:
-    def __init__(self, interpreter=None, logger=None):
+    def __init__(self, interpreter=None, logger=None, packrat=False,
+                 compact=False, concurrency=False, batch_reads=False,
+                 snapshot=False, parallel=False, coalesce=False,
+                 tracing=False, metrics=None):
 
         self.local_vars = {}
         self.global_vars = {}
 
+        # Every name ever set as a local. Bumping bindings whenever a
+        # global changes or a new local appears lets nodes cache what
+        # a var resolves to until the next bump.
+        self.local_names = set()
+        self.bindings = 0
+
+        # Rebuilt whenever area_shortcuts is assigned.
+        self.areas = AreaIndex()
+
+        # Running totals of work evaluation was able to skip.
+        self.counters = Counter()
+
+        # False disables packrat parsing, True uses the default
+        # cache size and an int sets the cache size.
+        self.packrat = packrat
+
+        # Compact nodes drop their ParseResults once built.
+        self.compact = compact
+
+        # False reads state one entity at a time. True reads every
+        # state a condition or switch needs at once and an int caps
+        # how many reads are in flight.
+        self.concurrency = concurrency
+
+        # Inside a run, reads made in the same loop iteration are
+        # answered by one Interpreter.get_states call.
+        self.batch_reads = batch_reads
+
+        # Inside a run, each state is read at most once until a
+        # command writes to that entity.
+        self.snapshot = snapshot
+
+        # Adjacent commands in a block that don't touch the same
+        # entities are started together, limited like concurrency.
+        self.parallel = parallel
+
+        # Runs of the same service call in a block, on different
+        # targets, are made as one call.
+        self.coalesce = coalesce
+
+        # Runs record a trace of timing spans while this is on; the
+        # traces of the latest runs are kept.
+        self.tracing = tracing
+        self.traces = deque(maxlen=100)
+
+        # A MetricsRegistry that named runs report to, if any.
+        self.metrics = metrics
+
         if logger is None:
             self.log = PrintLogger('none')
         else:
@@ -50,13 +308,211 @@ class OttoContext:
             return local
 
     def update_vars(self, dictionary):
+        if AREA_SHORTCUTS in dictionary:
+            shortcuts = dictionary[AREA_SHORTCUTS]
+            if shortcuts is None:
+                shortcuts = self.global_vars.get(AREA_SHORTCUTS)
+            self.areas = AreaIndex(shortcuts)
+
         self.local_vars.update(dictionary)
 
+        if not self.local_names.issuperset(dictionary):
+            self.local_names.update(dictionary)
+            self.bindings += 1
+
     def update_global_vars(self, dictionary):
+        if AREA_SHORTCUTS in dictionary:
+            shortcuts = self.local_vars.get(AREA_SHORTCUTS)
+            if shortcuts is None:
+                shortcuts = dictionary[AREA_SHORTCUTS]
+            self.areas = AreaIndex(shortcuts)
+
         self.global_vars.update(dictionary)
+        self.bindings += 1
+
+    def is_constant(self, name):
+        """True if name can only change through update_global_vars"""
+        return name not in self.local_names
+
+    async def get_state(self, name):
+        values = prefetched_states.get()
+
+        if values is not None and name in values:
+            return values[name]
+
+        return await self.read_state(name)
+
+    async def read_state(self, name):
+        """Read name through the current run, if there is one"""
+        run = current_run.get()
+
+        if run is not None:
+            return await run.read(name)
+
+        return await self.interpreter.get_state(name)
+
+    async def set_state(self, entity_name, **kwargs):
+        count('set_state')
+        result = await self.backend(
+            'set_state', self.interpreter.set_state(entity_name, **kwargs))
+        self.changed([entity_name])
+        return result
+
+    async def set_states(self, entity_names, **kwargs):
+        """Set every entity in entity_names, in one call if there are many"""
+        if len(entity_names) == 1:
+            return [await self.set_state(entity_names[0], **kwargs)]
 
+        count('set_states')
+        results = await self.backend(
+            'set_state', self.interpreter.set_states(entity_names, **kwargs))
+        self.changed(entity_names)
+        return list(results)
 
-class OttoBase:
+    async def call_service(self, domain, service_name, **kwargs):
+        count('call_service')
+        result = await self.backend(
+            'call_service',
+            self.interpreter.call_service(domain, service_name, **kwargs))
+
+        entities = kwargs.get('entity_id')
+        if isinstance(entities, str):
+            entities = [entities]
+
+        # Calls on areas, or on nothing in particular, could have
+        # changed any entity.
+        if entities and not kwargs.get('area_id'):
+            self.changed(entities)
+        else:
+            self.changed(None)
+
+        return result
+
+    async def backend(self, call, aw):
+        """Await a backend call, timing it if the run keeps metrics"""
+        run = current_run.get()
+
+        if run is None or run.metrics is None:
+            return await aw
+
+        return await run.metrics.time_call(call, aw)
+
+    def note_condition(self, result):
+        run = current_run.get()
+
+        if run is not None and run.metrics is not None:
+            run.metrics.condition(result)
+
+    def changed(self, entities):
+        """Note that entities (None for any) may have a new state"""
+        run = current_run.get()
+
+        if run is not None:
+            run.invalidate(entities)
+
+    def is_prefetched(self, name):
+        values = prefetched_states.get()
+        return values is not None and name in values
+
+    async def read_states(self, names):
+        """Read every state in names not already read, all at once"""
+        values = prefetched_states.get() or {}
+        missing = [name for name in dict.fromkeys(names)
+                   if name not in values]
+
+        if missing:
+            read = self.read_state
+            results = await self.gather([read(name) for name in missing])
+            values = {**values, **dict(zip(missing, results))}
+            self.counters['prefetched_reads'] += len(missing)
+
+        return values
+
+    @contextmanager
+    def run(self, name=None):
+        """Scope one execution of an automation"""
+        state = RunState(self, name)
+        token = current_run.set(state)
+
+        if state.trace is not None:
+            span = current_span.set(state.trace.root)
+
+        try:
+            yield state
+        except BaseException:
+            state.failed = True
+            raise
+        finally:
+            if state.trace is not None:
+                current_span.reset(span)
+            current_run.reset(token)
+            state.close()
+
+    @contextmanager
+    def use_states(self, values):
+        """Answer get_state from values inside the block"""
+        if values is None:
+            yield
+            return
+
+        token = prefetched_states.set(values)
+        try:
+            yield
+        finally:
+            prefetched_states.reset(token)
+
+    async def gather(self, aws):
+        """Await aws concurrently, at most self.concurrency at a time"""
+        limit = self.concurrency
+
+        if limit is True or not limit or limit >= len(aws):
+            return await asyncio.gather(*aws)
+
+        semaphore = asyncio.Semaphore(limit)
+
+        async def limited(aw):
+            async with semaphore:
+                return await aw
+
+        return await asyncio.gather(*[limited(aw) for aw in aws])
+
+
+def _restore(cls):
+    return object.__new__(cls)
+
+
+# Zero-width match whose parse action returns where the node ended.
+end_marker = Empty().leave_whitespace().set_parse_action(
+    lambda s, loc, toks: loc)
+
+_slot_names = {}
+
+
+class NodeType(type):
+    """Metaclass of OttoBase.
+
+    The class-level default context used to be stored as ctx, which is
+    now the per-node slot. This keeps OttoBase.ctx (and the same on any
+    node class) working as an alias for the class-level context.
+    """
+
+    @property
+    def ctx(cls):
+        return cls.context
+
+    @ctx.setter
+    def ctx(cls, context):
+        cls.context = context
+
+
+class OttoBase(metaclass=NodeType):
+    __slots__ = ('ctx', 'parse_results', 'tokens',
+                 '_source', '_start', '_end')
+    separator = " "
+
+    # Slots holding values derived at run time, which are neither
+    # pickled nor walked.
+    caches = ()
 
     def __new__(cls, *args, **kwargs):
         if len(args) > 0 and type(args[0]) == ParseResults:
@@ -67,7 +523,7 @@ class OttoBase:
     def __init__(self, tokens, *args, **kwargs):
         super().__init__(*[], **{})
 
-        self.ctx = type(self).ctx
+        self.ctx = type(self).context
         self.parse_results = tokens
         self.tokens = tokens[0]
 
@@ -80,10 +536,130 @@ class OttoBase:
             print(error)
 
     def __str__(self):
-        return " ".join([str(x) for x in self.tokens])
+        try:
+            tokens = self.tokens
+        except AttributeError:
+            source = self._source[self._start:self._end]
+            return " ".join(source.split())
+
+        return self.separator.join([str(x) for x in tokens])
+
+    def __reduce_ex__(self, protocol):
+        # __new__ builds a parser when called without tokens,
+        # so nodes are recreated through _restore instead.
+        return (_restore, (type(self),), self.__getstate__())
+
+    def __getstate__(self):
+        return {k: v for k, v in self.fields()
+                if k != 'ctx' and k not in self.caches}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+        # Trees unpickled before any context is set get one when bound.
+        self.ctx = getattr(type(self), 'context', None)
+
+    @classmethod
+    def slot_names(cls):
+        names = _slot_names.get(cls)
+
+        if names is None:
+            names = []
+            for klass in reversed(cls.__mro__):
+                for name in klass.__dict__.get('__slots__', ()):
+                    if name not in ('__dict__', '__weakref__'):
+                        names.append(name)
+            _slot_names[cls] = names
+
+        return names
+
+    def fields(self):
+        """Yield (name, value) for every attribute set on the node"""
+        for name in self.slot_names():
+            try:
+                yield name, getattr(self, name)
+            except AttributeError:
+                pass
+
+        # Subclasses that don't declare __slots__ still get a __dict__.
+        if hasattr(self, '__dict__'):
+            yield from self.__dict__.items()
+
+    def locate(self, source, start, end):
+        self._source = source
+        self._start = start
+        self._end = end
+
+    def compact(self):
+        """Release the ParseResults, keeping only the node's fields"""
+        for name in ('parse_results', 'tokens'):
+            try:
+                delattr(self, name)
+            except AttributeError:
+                pass
 
     def copy(self):
-        return type(self)(self.parse_results)
+        if hasattr(self, 'parse_results'):
+            node = type(self)(self.parse_results)
+            node.ctx = self.ctx
+            return node
+
+        node = _restore(type(self))
+        for k, v in self.fields():
+            setattr(node, k, v)
+        return node
+
+    def walk(self):
+        """Yield this node and every node below it"""
+        seen = set()
+        stack = [self]
+
+        while stack:
+            item = stack.pop()
+
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+
+            if isinstance(item, OttoBase):
+                yield item
+                stack.extend(v for k, v in item.fields()
+                             if k not in ('ctx', '_source')
+                             and k not in item.caches)
+            elif isinstance(item, dict):
+                stack.extend(item.values())
+            elif isinstance(item, (list, tuple, ParseResults)):
+                stack.extend(item)
+
+    def bind(self, ctx=None):
+        """Attach the whole tree to ctx and redo its parse-time effects"""
+        if ctx is None:
+            ctx = type(self).context
+
+        nodes = list(self.walk())
+        for node in nodes:
+            node.ctx = ctx
+        for node in nodes:
+            node.activate()
+        for node in nodes:
+            node.fold()
+
+    def activate(self):
+        """Apply any effect the node has on its context when parsed"""
+
+    def resolve(self):
+        """Fold constant vars and targets in the tree into the nodes"""
+        for node in self.walk():
+            node.fold()
+
+    def fold(self):
+        """Drop anything cached against the context and work it out again"""
+        for name in self.caches:
+            try:
+                delattr(self, name)
+            except AttributeError:
+                pass
 
     def debugtree(self, levels=5):
         if levels == 0:
@@ -100,12 +676,49 @@ class OttoBase:
     async def eval(self):
         return self._value
 
+    @classmethod
+    def parse(cls, string, *args, packrat=None, parse_all=False, **kwargs):
+        if packrat is None:
+            ctx = getattr(cls, 'context', None)
+            packrat = ctx.packrat if ctx is not None else False
+
+        parser = cls.pre_parse(*args, **kwargs)
+
+        if not packrat:
+            return parser.parse_string(string, parse_all=parse_all)[0]
+
+        if packrat is True:
+            packrat = DEFAULT_PACKRAT_SIZE
+
+        with packrat_mode(packrat):
+            return parser.parse_string(string, parse_all=parse_all)[0]
+
     @classmethod
     def pre_parse(cls, *args, **kwargs):
+        return grammar_registry.get(cls, *args, **kwargs)
+
+    @classmethod
+    def build_parser(cls, *args, **kwargs):
         cls.parser.set_name(cls.__name__)
-        prs = cls.parser.copy()
-        return prs.set_parse_action(lambda x:
-                                    cls.post_parse(x, *args, **kwargs))
+        return cls.attach(cls.parser, *args, **kwargs)
+
+    @classmethod
+    def attach(cls, parser, *args, **kwargs):
+        """Make parser produce cls nodes that know where they matched"""
+
+        def action(source, start, tokens):
+            end = tokens.pop()
+            node = cls.post_parse(tokens, *args, **kwargs)
+            node.locate(source, start, end)
+
+            if node.ctx.compact:
+                node.compact()
+
+            return node
+
+        parser = parser + end_marker
+        parser.set_name(cls.__name__)
+        return parser.set_parse_action(action)
 
     @classmethod
     def post_parse(cls, tokens, *args, **kwargs):
@@ -113,7 +726,8 @@ class OttoBase:
 
     @classmethod
     def set_context(cls, context=None):
+        # Stored as 'context' because 'ctx' is the per-node slot.
         if context is None:
-            cls.ctx = OttoContext()
+            cls.context = OttoContext()
         else:
-            cls.ctx = context
+            cls.context = context
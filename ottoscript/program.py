@@ -0,0 +1,109 @@
+import mmap
+import os
+import re
+from contextlib import contextmanager
+from .controls import Auto
+
+# Quoted strings are matched (and skipped) so a ';' inside them
+# doesn't end the block.
+BOUNDARY = re.compile(r"""'[^']*'|"[^"]*"|;""")
+BYTES_BOUNDARY = re.compile(BOUNDARY.pattern.encode())
+
+
+class Program:
+    """A file of ';' terminated automations, parsed one block at a time.
+
+    source may be the text itself, a path (any os.PathLike) or an open
+    file object. Files of mmap_threshold bytes or more are memory-mapped
+    rather than read, and each block is only decoded when it is parsed.
+    Spans are character offsets into the decoded text whatever the
+    source, so files read as bytes give the same spans as their text.
+    """
+
+    def __init__(self, source, cache=None, packrat=None,
+                 encoding="utf-8", mmap_threshold=1 << 20):
+        self.source = source
+        self.cache = cache
+        self.packrat = packrat
+        self.encoding = encoding
+        self.mmap_threshold = mmap_threshold
+
+    def __iter__(self):
+        return self.parse()
+
+    def parse(self):
+        """Yield an Auto for every block, with its span in the source"""
+        for start, end, text in self.blocks():
+            # Anything in a block after its automation is an error.
+            if self.cache is not None:
+                auto = self.cache.load(text, parse_all=True)
+            else:
+                auto = Auto.parse(text, packrat=self.packrat, parse_all=True)
+
+            auto.span = (start, end)
+            yield auto
+
+    def blocks(self):
+        """Yield (start, end, text) for every non-empty block"""
+        with self.buffer() as buffer:
+            if isinstance(buffer, str):
+                boundary = BOUNDARY
+                decode = str
+            else:
+                boundary = BYTES_BOUNDARY
+                decode = self.decode
+
+            # Where the block starts in buffer, and in characters.
+            start = 0
+            offset = 0
+            for match in boundary.finditer(buffer):
+                if match.group() not in (";", b";"):
+                    continue
+
+                text = decode(buffer[start:match.start()])
+                if text.strip():
+                    yield offset, offset + len(text), text
+                start = match.end()
+                offset += len(text) + 1
+
+            text = decode(buffer[start:])
+            if text.strip():
+                yield offset, offset + len(text), text
+
+    def decode(self, data):
+        return data.decode(self.encoding)
+
+    @contextmanager
+    def buffer(self):
+        if isinstance(self.source, (str, bytes)):
+            yield self.source
+        elif isinstance(self.source, os.PathLike):
+            with open(self.source, "rb") as file:
+                with self.map(file) as buffer:
+                    yield buffer
+        else:
+            with self.map(self.source) as buffer:
+                yield buffer
+
+    @contextmanager
+    def map(self, file):
+        try:
+            size = os.fstat(file.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            size = None
+
+        if size is None or size < self.mmap_threshold or size == 0:
+            yield file.read()
+            return
+
+        # mmap always maps from the start of the file, so only
+        # files opened in binary mode at offset 0 are mapped.
+        if "b" not in getattr(file, "mode", "") or file.tell() != 0:
+            yield file.read()
+            return
+
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield buffer
+        finally:
+            buffer.close()
@@ -0,0 +1,183 @@
+import asyncio
+import functools
+from contextvars import ContextVar
+from time import perf_counter
+from .tracing import Trace, count
+
+# The automation run the current task is executing, if any.
+current_run = ContextVar('current_run', default=None)
+
+
+class ReadBatcher:
+    """Read every state asked for in the same loop iteration together.
+
+    The first read schedules a flush; anything else requested before
+    the flush runs joins it, and the whole batch is answered by a
+    single Interpreter.get_states call.
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.pending = {}
+        self.flushes = set()
+        self.batches = 0
+        self.reads = 0
+
+    def get(self, name):
+        future = self.pending.get(name)
+
+        if future is None:
+            loop = asyncio.get_running_loop()
+
+            if not self.pending:
+                # Keep a reference, the loop only holds tasks weakly.
+                task = loop.create_task(self.flush(self.pending))
+                self.flushes.add(task)
+                task.add_done_callback(
+                    functools.partial(self.settle, self.pending))
+
+            future = self.pending[name] = loop.create_future()
+
+        return future
+
+    async def flush(self, pending):
+        self.pending = {}
+        self.batches += 1
+        self.reads += len(pending)
+
+        try:
+            values = await self.interpreter.get_states(list(pending))
+        except Exception as error:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        # Names the backend left out read as unknown, as with get_state.
+        for name, future in pending.items():
+            if not future.done():
+                future.set_result(values.get(name))
+
+    def settle(self, pending, task):
+        """Cancel the reads a finished flush left unanswered.
+
+        That only happens when the flush was cancelled, possibly before
+        it started, so its batch may still be the one taking reads.
+        """
+        self.flushes.discard(task)
+
+        if self.pending is pending:
+            self.pending = {}
+
+        for future in pending.values():
+            if not future.done():
+                future.cancel()
+
+
+class RunState:
+    """Per-run helpers for one execution of an automation"""
+
+    def __init__(self, ctx, name=None):
+        self.ctx = ctx
+        self.name = name
+
+        if ctx.batch_reads:
+            self.batcher = ReadBatcher(ctx.interpreter)
+        else:
+            self.batcher = None
+
+        # The first read of each state, kept for the rest of the run.
+        if ctx.snapshot:
+            self.snapshot = {}
+        else:
+            self.snapshot = None
+
+        self.generation = 0
+        self.hits = 0
+
+        # Service calls saved by merging them with others.
+        self.coalesced = 0
+
+        if ctx.tracing:
+            self.trace = Trace(name)
+        else:
+            self.trace = None
+
+        # Only runs with a name can report metrics.
+        if ctx.metrics is not None and name is not None:
+            self.metrics = ctx.metrics.automation(name)
+            self.metrics.started += 1
+        else:
+            self.metrics = None
+
+        self.start = perf_counter()
+        self.failed = False
+
+    async def read(self, name):
+        snapshot = self.snapshot
+
+        if snapshot is not None and name in snapshot:
+            self.hits += 1
+            return snapshot[name]
+
+        generation = self.generation
+        count('get_state')
+
+        if self.batcher is not None:
+            read = self.batcher.get(name)
+        else:
+            read = self.ctx.interpreter.get_state(name)
+
+        if self.metrics is not None:
+            value = await self.metrics.time_call('get_state', read)
+        else:
+            value = await read
+
+        # A write while the read was in flight may already have
+        # made the value stale, so it isn't kept.
+        if snapshot is not None and generation == self.generation:
+            snapshot[name] = value
+
+        return value
+
+    def invalidate(self, entities=None):
+        """Forget what was read for entities, or everything if None"""
+        if self.snapshot is None:
+            return
+
+        self.generation += 1
+
+        if entities is None:
+            self.snapshot.clear()
+            return
+
+        for entity in entities:
+            entity = ".".join(entity.split(".")[:2])
+            prefix = entity + "."
+            for name in [name for name in self.snapshot
+                         if name == entity or name.startswith(prefix)]:
+                del self.snapshot[name]
+
+    def close(self):
+        counters = self.ctx.counters
+
+        if self.batcher is not None:
+            counters['read_batches'] += self.batcher.batches
+            counters['batched_reads'] += self.batcher.reads
+
+        if self.snapshot is not None:
+            counters['snapshot_hits'] += self.hits
+
+        if self.coalesced:
+            counters['coalesced_calls'] += self.coalesced
+
+        if self.trace is not None:
+            self.trace.close()
+            self.ctx.traces.append(self.trace)
+
+        if self.metrics is not None:
+            if self.failed:
+                self.metrics.failed += 1
+            else:
+                self.metrics.finished += 1
+            self.metrics.run_seconds.observe(perf_counter() - self.start)
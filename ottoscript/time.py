@@ -2,12 +2,11 @@ from pyparsing import (CaselessKeyword,
                        Group,
                        Combine,
                        MatchFirst,
-                       MatchFirst,
                        Char,
                        nums,
                        Optional,
                        common)
-from .ottobase import OttoBase
+from .ottobase import OttoBase, grammar
 from .keywords import HOUR, MINUTE, SECOND
 from .datatypes import Number,  Var
 
@@ -23,7 +22,11 @@ WEEKEND = MatchFirst(map(CaselessKeyword, "WEEKEND WEEKENDS".split()))
 
 
 class Hour(OttoBase):
-    parser = Group(HOUR("string"))
+    __slots__ = ('string',)
+
+    @grammar
+    def parser(cls):
+        return Group(HOUR("string"))
 
     @property
     def seconds(self):
@@ -31,7 +34,11 @@ class Hour(OttoBase):
 
 
 class Minute(OttoBase):
-    parser = Group(MINUTE("string"))
+    __slots__ = ('string',)
+
+    @grammar
+    def parser(cls):
+        return Group(MINUTE("string"))
 
     @property
     def seconds(self):
@@ -39,7 +46,11 @@ class Minute(OttoBase):
 
 
 class Second(OttoBase):
-    parser = Group(SECOND('string'))
+    __slots__ = ('string',)
+
+    @grammar
+    def parser(cls):
+        return Group(SECOND('string'))
 
     @property
     def seconds(self):
@@ -47,26 +58,37 @@ class Second(OttoBase):
 
 
 class TimePart(OttoBase):
+    __slots__ = ()
 
     @classmethod
-    def pre_parse(cls, *args, **kwargs):
+    def build_parser(cls, *args, **kwargs):
         cls.parser.set_name(cls.__name__)
-        parser = MatchFirst(cls.parser, Var())
-        parser = parser.set_parse_action(lambda x: cls(x, *args, **kwargs))
-        return parser
+        parser = MatchFirst([cls.parser, Var()])
+        return cls.attach(parser, *args, **kwargs)
+
+    @classmethod
+    def post_parse(cls, tokens, *args, **kwargs):
+        # A var stands in for the time part and parses as itself.
+        if type(tokens[0]) == Var:
+            return tokens[0]
+        return cls(tokens, *args, **kwargs)
 
 
 class DayOfWeek(TimePart):
-    parser = Group(MONDAY("option")
-                   | TUESDAY("option")
-                   | WEDNESDAY("option")
-                   | THURSDAY("option")
-                   | FRIDAY("option")
-                   | SATURDAY("option")
-                   | SUNDAY("option")
-                   | WEEKDAY("option")
-                   | WEEKEND("option")
-                   )
+    __slots__ = ('option',)
+
+    @grammar
+    def parser(cls):
+        return Group(MONDAY("option")
+                     | TUESDAY("option")
+                     | WEDNESDAY("option")
+                     | THURSDAY("option")
+                     | FRIDAY("option")
+                     | SATURDAY("option")
+                     | SUNDAY("option")
+                     | WEEKDAY("option")
+                     | WEEKEND("option")
+                     )
 
     @property
     def days(self):
@@ -79,11 +101,16 @@ class DayOfWeek(TimePart):
 
 
 class TimeStamp(TimePart):
+    __slots__ = ('hour', 'minute', 'second')
+
     digits = Combine(Char(nums) * 2)
-    parser = Group(digits("hour")
-                   + ":" + digits("minute")
-                   + Optional(":" + digits("second"))
-                   )
+
+    @grammar
+    def parser(cls):
+        return Group(cls.digits("hour")
+                     + ":" + cls.digits("minute")
+                     + Optional(":" + cls.digits("second"))
+                     )
 
     def __init__(self, tokens):
         if not hasattr(self, 'seconds'):
@@ -102,11 +129,15 @@ class TimeStamp(TimePart):
 
 
 class RelativeTime(TimePart):
-    parser = Group(Number()("count")
-                   + (Hour()("unit")
-                   | Minute()("unit")
-                   | Second()("unit"))
-                   )
+    __slots__ = ('count', 'unit')
+
+    @grammar
+    def parser(cls):
+        return Group(Number()("count")
+                     + (Hour()("unit")
+                     | Minute()("unit")
+                     | Second()("unit"))
+                     )
 
     @property
     def seconds(self):
@@ -118,12 +149,21 @@ class RelativeTime(TimePart):
 
 
 class Date(TimePart):
+    __slots__ = ('string', 'year', 'month', 'day')
+
     date = common.iso8601_date
-    parser = Group(date("string"))
+
+    @grammar
+    def parser(cls):
+        return Group(cls.date("string"))
 
 
 class DateTime(TimePart):
-    parser = Group(Date()("date") + TimeStamp()("time"))
+    __slots__ = ('date', 'time')
+
+    @grammar
+    def parser(cls):
+        return Group(Date()("date") + TimeStamp()("time"))
 
     @property
     def string(self):
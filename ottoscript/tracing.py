@@ -0,0 +1,162 @@
+"""Timing spans for automation runs.
+
+A run of a context with tracing on sets the root span of a Trace. Inside
+it, the places that evaluate an automation's parts - its clauses, the
+conditions and branches of IF and SWITCH, the comparisons of a
+condition and the commands of a block - record a Span under the span of
+the part that reached them, with the backend calls made directly inside
+it. eval(), compiled closures and VM code record the same spans. The
+spans of one run export as Chrome trace-event JSON for chrome://tracing
+or Perfetto.
+
+Outside a traced run, each of those places only pays for reading
+current_span.
+"""
+from collections import Counter
+from contextvars import ContextVar
+from time import perf_counter
+
+# The span evals in the current task record themselves under.
+current_span = ContextVar('current_span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'node', 'start', 'end', 'calls', 'children',
+                 'error')
+
+    def __init__(self, name, node=None):
+        self.name = name
+        self.node = node
+        self.start = perf_counter()
+        self.end = None
+        self.calls = Counter()
+        self.children = []
+        self.error = False
+
+    @property
+    def text(self):
+        # Working out source text is left until it is asked for.
+        return "" if self.node is None else str(self.node)
+
+    @property
+    def duration(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def total_calls(self):
+        """Return the calls made in this span and every span under it"""
+        calls = Counter(self.calls)
+        for child in self.children:
+            calls.update(child.total_calls())
+        return calls
+
+    def walk(self, depth=0):
+        """Yield (depth, span) for this span and every span under it"""
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'text': self.text,
+            'start': self.start,
+            'end': self.end,
+            'calls': dict(self.calls),
+            'error': self.error,
+            'children': [child.as_dict() for child in self.children]
+        }
+
+
+class Trace:
+    """The span tree of one run"""
+
+    def __init__(self, name=None):
+        self.root = Span('run', name)
+
+    def close(self):
+        self.root.end = perf_counter()
+
+    def to_chrome(self, pid=1, tid=1):
+        """Return the trace as a Chrome trace-event dict"""
+        origin = self.root.start
+        events = []
+
+        for _, span in self.root.walk():
+            end = span.end if span.end is not None else perf_counter()
+            args = {'text': span.text}
+            if span.calls:
+                args['calls'] = dict(span.calls)
+            if span.error:
+                args['error'] = True
+
+            events.append({
+                'name': span.name,
+                'cat': 'ottoscript',
+                'ph': 'X',
+                'ts': (span.start - origin) * 1e6,
+                'dur': (end - span.start) * 1e6,
+                'pid': pid,
+                'tid': tid,
+                'args': args
+            })
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def count(call):
+    """Count a backend call against the current span, if any"""
+    span = current_span.get()
+    if span is not None:
+        span.calls[call] += 1
+
+
+def evaluate(node, eval=None):
+    """Return the awaitable of node.eval(), or of eval() when given.
+
+    In a traced run it records a span for node; everywhere else it is
+    the plain call.
+    """
+    if current_span.get() is None:
+        return node.eval() if eval is None else eval()
+
+    return trace(node, node.eval if eval is None else eval)
+
+
+def open_span(node):
+    """Start a span for node under the current one, if there is one.
+
+    Returns what close_span needs to end it.
+    """
+    parent = current_span.get()
+
+    if parent is None:
+        return None
+
+    span = Span(type(node).__name__, node)
+    parent.children.append(span)
+    return span, current_span.set(span)
+
+
+def close_span(opened, error=False):
+    if opened is None:
+        return
+
+    span, token = opened
+    span.end = perf_counter()
+    span.error = span.error or error
+    current_span.reset(token)
+
+
+async def trace(node, eval):
+    opened = open_span(node)
+
+    try:
+        result = await eval()
+    except BaseException:
+        close_span(opened, error=True)
+        raise
+
+    close_span(opened)
+    return result
@@ -3,13 +3,14 @@ from pyparsing import (CaselessKeyword,
                        Optional,
                        Group,
                        )
-from .ottobase import OttoBase
+from .ottobase import OttoBase, grammar
 from .keywords import FROM, TO, FOR, ON, BEFORE, AFTER, SUNRISE, SUNSET
 from .datatypes import Entity, Number, List, String, Var
 from .time import RelativeTime, TimeStamp, DayOfWeek
 
 
 class StateTrigger(OttoBase):
+    __slots__ = ()
 
     @property
     def strings(self):
@@ -48,17 +49,24 @@ class StateTrigger(OttoBase):
 
 
 class StateChange(StateTrigger):
-    term = (Entity() | Number() | String())
-    parser = Group(
-        List(Entity())("entities")
-        + CaselessKeyword("CHANGES")
-        + Optional(FROM + (Entity()("_old")
-                           | Number()("_old") | String()("_old")))
-        + Optional(TO + (Entity()("_new")
-                         | Number()("_new") | String()("_new")))
-        + Optional(FOR + (TimeStamp()("_hold")
-                          | RelativeTime()("_hold")))
-    )
+    __slots__ = ('entities', '_old', '_new', '_hold')
+
+    @grammar
+    def term(cls):
+        return Entity() | Number() | String()
+
+    @grammar
+    def parser(cls):
+        return Group(
+            List(Entity())("entities")
+            + CaselessKeyword("CHANGES")
+            + Optional(FROM + (Entity()("_old")
+                               | Number()("_old") | String()("_old")))
+            + Optional(TO + (Entity()("_new")
+                             | Number()("_new") | String()("_new")))
+            + Optional(FOR + (TimeStamp()("_hold")
+                              | RelativeTime()("_hold")))
+        )
 
     @property
     def hold_seconds(self):
@@ -97,6 +105,7 @@ class StateChange(StateTrigger):
 
 
 class TimeTrigger(OttoBase):
+    __slots__ = ('_days',)
 
     @property
     def strings(self):
@@ -131,9 +140,13 @@ class TimeTrigger(OttoBase):
 
 
 class WeeklySchedule(TimeTrigger):
-    parser = Group(List(TimeStamp())("_times")
-                   + Optional(ON + List(DayOfWeek())("_days"))
-                   )
+    __slots__ = ('_times', 'times')
+
+    @grammar
+    def parser(cls):
+        return Group(List(TimeStamp())("_times")
+                     + Optional(ON + List(DayOfWeek())("_days"))
+                     )
 
     def __init__(self, tokens):
         super().__init__(tokens)
@@ -146,14 +159,18 @@ class WeeklySchedule(TimeTrigger):
 
 
 class SunEvent(TimeTrigger):
-    parser = Group(Optional(RelativeTime()("time")
-                            + (BEFORE | AFTER)("relative")
-                            )("_offset")
-                   + (SUNRISE("_time")
-                      | SUNSET("_time")
-                      )
-                   + Optional(ON + List(DayOfWeek())("_days"))
-                   )
+    __slots__ = ('_offset', '_time', 'time', 'relative')
+
+    @grammar
+    def parser(cls):
+        return Group(Optional(RelativeTime()("time")
+                              + (BEFORE | AFTER)("relative")
+                              )("_offset")
+                     + (SUNRISE("_time")
+                        | SUNSET("_time")
+                        )
+                     + Optional(ON + List(DayOfWeek())("_days"))
+                     )
 
     @property
     def offset(self):
@@ -0,0 +1,345 @@
+"""A small register machine for lowered ottoscript actions.
+
+Instructions are tuples of (opcode, *operands); SIGNATURES names the
+operands of each opcode. Registers are numbered slots in a list that is
+allocated fresh for every run, and jump targets are instruction indices.
+"""
+from .logs import is_enabled
+from .ottobase import prefetched_states
+from .tracing import close_span, current_span, open_span
+
+(LOAD_CONST, LOAD_STATE, LOAD_VAR, EVAL, NUMERIC, CMP, TEST, TARGETS,
+ BUILD, MERGE, CALL_SERVICE, SET_STATE, SLEEP, ASSIGN, LOG, LOG_RESULT,
+ JUMP, JUMP_IF_FALSE, JUMP_IF_NOT_TRUE, SHORT_CIRCUIT, READ_STATES,
+ USE_STATES, RELEASE, BATCHED, SPAN, END_SPAN, RETURN) = range(27)
+
+# Operand names for each opcode, used by the disassembler.
+SIGNATURES = {
+    LOAD_CONST: ('dst', 'constant'),
+    LOAD_STATE: ('dst', 'name'),
+    LOAD_VAR: ('dst', 'var', 'attribute'),
+    EVAL: ('dst', 'function'),
+    NUMERIC: ('dst', 'src'),
+    CMP: ('dst', 'function', 'left', 'right'),
+    TEST: ('dst', 'function', 'regs'),
+    TARGETS: ('dst', 'function'),
+    BUILD: ('dst', 'template', 'pairs'),
+    MERGE: ('dst', 'regs'),
+    CALL_SERVICE: ('dst', 'domain', 'service_name', 'kwargs'),
+    SET_STATE: ('dst', 'function', 'src'),
+    SLEEP: ('dst', 'seconds'),
+    ASSIGN: ('namespace', 'vars'),
+    LOG: ('logger', 'level', 'template', 'regs'),
+    LOG_RESULT: ('reg', 'text'),
+    JUMP: ('target',),
+    JUMP_IF_FALSE: ('reg', 'target'),
+    JUMP_IF_NOT_TRUE: ('reg', 'target'),
+    SHORT_CIRCUIT: ('reg', 'decider', 'condition', 'items', 'target'),
+    READ_STATES: ('dst', 'condition'),
+    USE_STATES: ('src',),
+    RELEASE: (),
+    BATCHED: ('function', 'target'),
+    SPAN: ('node',),
+    END_SPAN: (),
+    RETURN: ('reg',)
+}
+
+REGISTERS = {'dst', 'src', 'reg', 'left', 'right', 'kwargs'}
+
+OPCODES = [
+    'LOAD_CONST',
+    'LOAD_STATE',
+    'LOAD_VAR',
+    'EVAL',
+    'NUMERIC',
+    'CMP',
+    'TEST',
+    'TARGETS',
+    'BUILD',
+    'MERGE',
+    'CALL_SERVICE',
+    'SET_STATE',
+    'SLEEP',
+    'ASSIGN',
+    'LOG',
+    'LOG_RESULT',
+    'JUMP',
+    'JUMP_IF_FALSE',
+    'JUMP_IF_NOT_TRUE',
+    'SHORT_CIRCUIT',
+    'READ_STATES',
+    'USE_STATES',
+    'RELEASE',
+    'BATCHED',
+    'SPAN',
+    'END_SPAN',
+    'RETURN'
+]
+
+NOTE_WIDTH = 72
+
+JUMPS = {JUMP: 1, JUMP_IF_FALSE: 2, JUMP_IF_NOT_TRUE: 2, SHORT_CIRCUIT: 5,
+         BATCHED: 2}
+
+
+class Code:
+    """Instructions for one tree, with the context they run against"""
+
+    def __init__(self, ctx, instructions, registers, notes=None):
+        self.ctx = ctx
+        self.instructions = instructions
+        self.registers = registers
+
+        # Source text of the node each instruction index starts.
+        self.notes = notes or {}
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def __str__(self):
+        return disassemble(self)
+
+
+async def run(code):
+    """Execute code and return whatever its RETURN instruction names"""
+    scopes = []
+
+    # Whether a run is traced can't change while it runs.
+    spans = [] if current_span.get() is not None else None
+
+    try:
+        return await execute(code, scopes, spans)
+    except BaseException:
+        while spans:
+            close_span(spans.pop(), error=True)
+        raise
+    finally:
+        # A failed run can leave read-ahead states in place.
+        while scopes:
+            token = scopes.pop()
+            if token is not None:
+                prefetched_states.reset(token)
+
+
+async def execute(code, scopes, spans):
+    ctx = code.ctx
+    instructions = code.instructions
+    end = len(instructions)
+    registers = [None] * code.registers
+    pc = 0
+
+    while pc < end:
+        instruction = instructions[pc]
+        op = instruction[0]
+        pc += 1
+
+        if op == LOG:
+            _, logger, level, template, regs = instruction
+            if logger == 'interpreter':
+                log = ctx.interpreter.log
+            else:
+                log = ctx.log
+
+            if is_enabled(log, level):
+                if regs:
+                    message = template.format(*[registers[r] for r in regs])
+                else:
+                    message = template
+                await getattr(log, level)(message)
+
+        elif op == LOAD_CONST:
+            registers[instruction[1]] = instruction[2]
+
+        elif op == LOAD_STATE:
+            registers[instruction[1]] = \
+                await ctx.get_state(instruction[2])
+
+        elif op == CMP:
+            _, dst, function, left, right = instruction
+            registers[dst] = function(registers[left], registers[right])
+
+        elif op == TEST:
+            _, dst, function, regs = instruction
+            registers[dst] = function([registers[r] for r in regs])
+
+        elif op == LOG_RESULT:
+            ctx.note_condition(registers[instruction[1]])
+
+            log = ctx.interpreter.log
+            if is_enabled(log, 'info'):
+                result = registers[instruction[1]]
+                await log.info(
+                    f"'{instruction[2]}' is {result}. "
+                    f"{'Executing' if result else 'Skipping'} commands."
+                )
+
+        elif op == JUMP:
+            pc = instruction[1]
+
+        elif op == JUMP_IF_FALSE:
+            if registers[instruction[1]] is False:
+                pc = instruction[2]
+
+        elif op == JUMP_IF_NOT_TRUE:
+            if registers[instruction[1]] is not True:
+                pc = instruction[2]
+
+        elif op == SHORT_CIRCUIT:
+            _, reg, decider, condition, items, target = instruction
+            if bool(registers[reg]) is decider:
+                condition.skipped(items)
+                pc = target
+
+        elif op == LOAD_VAR:
+            _, dst, var, attribute = instruction
+            value = var.fetch()
+
+            if hasattr(value, 'eval'):
+                if attribute is None:
+                    value = await value.eval()
+                else:
+                    value = await value.eval(attribute=attribute)
+            elif attribute is not None:
+                value = value.get(attribute)
+
+            registers[dst] = value
+
+        elif op == TARGETS:
+            registers[instruction[1]] = instruction[2]()
+
+        elif op == BUILD:
+            _, dst, template, pairs = instruction
+            result = dict(template)
+            for key, reg in pairs:
+                result[key] = registers[reg]
+            registers[dst] = result
+
+        elif op == MERGE:
+            result = {}
+            for reg in instruction[2]:
+                result.update(registers[reg])
+            registers[instruction[1]] = result
+
+        elif op == CALL_SERVICE:
+            _, dst, domain, service_name, kwargs = instruction
+            registers[dst] = await ctx.call_service(
+                domain, service_name, **registers[kwargs])
+
+        elif op == SET_STATE:
+            _, dst, names, value = instruction
+            registers[dst] = await ctx.set_states(names(),
+                                                  value=registers[value])
+
+        elif op == SLEEP:
+            registers[instruction[1]] = \
+                await ctx.interpreter.sleep(instruction[2])
+
+        elif op == ASSIGN:
+            if instruction[1] == 'local':
+                ctx.update_vars(instruction[2])
+            elif instruction[1] == 'global':
+                ctx.update_global_vars(instruction[2])
+
+        elif op == NUMERIC:
+            result = registers[instruction[2]]
+            try:
+                result = float(result)
+            except ValueError as error:
+                await ctx.log.error(error)
+                result = None
+            registers[instruction[1]] = result
+
+        elif op == READ_STATES:
+            # Only read ahead when the context asks for it.
+            if ctx.concurrency:
+                registers[instruction[1]] = \
+                    await ctx.read_states(instruction[2].reads())
+
+        elif op == USE_STATES:
+            values = registers[instruction[1]]
+            if values is None:
+                scopes.append(None)
+            else:
+                scopes.append(prefetched_states.set(values))
+
+        elif op == RELEASE:
+            token = scopes.pop()
+            if token is not None:
+                prefetched_states.reset(token)
+
+        elif op == SPAN:
+            # Only runs that are traced record spans.
+            if spans is not None:
+                spans.append(open_span(instruction[1]))
+
+        elif op == END_SPAN:
+            if spans is not None:
+                close_span(spans.pop())
+
+        elif op == BATCHED:
+            # Blocks run their commands in batches when asked to.
+            if ctx.parallel or ctx.coalesce:
+                await instruction[1]()
+                pc = instruction[2]
+
+        elif op == EVAL:
+            registers[instruction[1]] = await instruction[2]()
+
+        elif op == RETURN:
+            reg = instruction[1]
+            return None if reg is None else registers[reg]
+
+        else:
+            raise ValueError(f"Unknown opcode {op} at {pc - 1}")
+
+    return None
+
+
+def describe(kind, operand):
+    if operand is None:
+        return repr(operand)
+    if kind in REGISTERS:
+        return f"r{operand}"
+    if kind == 'regs':
+        return "(" + ", ".join(f"r{r}" for r in operand) + ")"
+    if kind == 'pairs':
+        return "{" + ", ".join(f"{k!r}: r{r}" for k, r in operand) + "}"
+    if kind == 'var':
+        return str(operand)
+    if kind in ('condition', 'node'):
+        return f"<{type(operand).__name__}>"
+    if kind == 'items':
+        return f"<{len(operand)} skipped>"
+    if kind == 'vars':
+        return "{" + ", ".join(f"{k}: {v}" for k, v in operand.items()) + "}"
+    if callable(operand):
+        return f"<{getattr(operand, '__qualname__', repr(operand))}>"
+    return repr(operand)
+
+
+def disassemble(code):
+    """Return a listing of code, one instruction per line"""
+    targets = {instruction[JUMPS[instruction[0]]]
+               for instruction in code.instructions
+               if instruction[0] in JUMPS}
+    width = len(str(len(code.instructions)))
+    lines = []
+
+    for index, instruction in enumerate(code.instructions):
+        note = code.notes.get(index)
+        if note is not None:
+            if len(note) > NOTE_WIDTH:
+                note = note[:NOTE_WIDTH - 3] + "..."
+            lines.append(f"# {note}")
+
+        marker = ">>" if index in targets else "  "
+        name = OPCODES[instruction[0]]
+        operands = ", ".join(
+            describe(kind, operand)
+            for kind, operand in zip(SIGNATURES[instruction[0]],
+                                     instruction[1:])
+        )
+        line = f"{marker} {index:>{width}} {name:<16} {operands}"
+        lines.append(line.rstrip())
+
+    return "\n".join(lines)
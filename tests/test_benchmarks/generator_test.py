@@ -0,0 +1,28 @@
+import pytest
+from benchmarks.generator import Generator, Workload
+from ottoscript.ottobase import OttoBase
+from ottoscript.program import Program
+
+
+@pytest.mark.asyncio
+async def test_generator_is_seeded():
+    """Verify the same seed always gives the same program"""
+
+    workload = Workload(automations=3, seed=7)
+
+    assert Generator(workload).program() == Generator(workload).program()
+    assert (Generator(workload).program()
+            != Generator(Workload(automations=3, seed=8)).program())
+
+
+@pytest.mark.asyncio
+async def test_generated_program_parses():
+    """Verify generated programs are valid ottoscript"""
+
+    OttoBase.set_context()
+    workload = Workload(automations=3, triggers=2, depth=2, seed=1)
+    autos = list(Program(Generator(workload).program()))
+
+    assert [a.controls.name for a in autos] == [
+        "generated_0", "generated_1", "generated_2"
+    ]
@@ -0,0 +1,56 @@
+import pytest
+from ottoscript import cache
+from ottoscript.cache import CompiledCache
+from ottoscript.ottobase import OttoBase, OttoContext
+
+SOURCE = """@working = input_boolean.working
+            AUTO work_start
+              WHEN 08:00 on WEEKDAY
+                IF NOT @working == 'on'
+                  SET @working TO 'on'
+                END
+         """
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_skips_parser(tmp_path):
+    """Verify a second load comes from disk and restores globals"""
+
+    OttoBase.set_context()
+    store = CompiledCache(tmp_path)
+    first = store.load(SOURCE)
+
+    ctx = OttoContext()
+    OttoBase.set_context(ctx)
+    second = store.load(SOURCE)
+
+    assert store.stats()['misses'] == 1
+    assert store.stats()['hits'] == 1
+    assert second is not first
+    assert second.controls.name == "work_start"
+    assert second.actions.ctx is ctx
+    assert ctx.global_vars["@working"].name == "input_boolean.working"
+    assert await second.actions.clauses[0].conditions.eval() is True
+
+
+@pytest.mark.asyncio
+async def test_cache_invalidation(tmp_path, monkeypatch):
+    """Verify edits, version changes and bad entries miss the cache"""
+
+    OttoBase.set_context()
+    store = CompiledCache(tmp_path)
+    store.load(SOURCE)
+    store.load(SOURCE.replace("08:00", "09:00"))
+
+    monkeypatch.setattr(cache, "__version__", "0.0.0-test")
+    store.load(SOURCE)
+    monkeypatch.undo()
+
+    store.entry(SOURCE).write_bytes(b"not a pickle")
+    store.load(SOURCE)
+
+    assert store.stats()['misses'] == 4
+    assert store.stats()['hits'] == 0
+    assert store.stats()['errors'] == 1
+    assert store.load(SOURCE).controls.name == "work_start"
+    assert store.stats()['hits'] == 1
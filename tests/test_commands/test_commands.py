@@ -1,5 +1,5 @@
 import pytest
-from ottoscript.ottobase import OttoBase
+from ottoscript.ottobase import OttoBase, OttoContext
 from ottoscript.datatypes import String
 from ottoscript.commands import (Assignment,
                                  Pass,
@@ -15,6 +15,7 @@ from ottoscript.commands import (Assignment,
                                  Wait
                                  )
 from ottoscript.interpreters import Interpreter
+from ottoscript.time import RelativeTime
 
 interpreter = Interpreter()
 OttoBase.set_context()
@@ -65,6 +66,37 @@ async def test_set():
     assert await n.eval() == expected
 
 
+@pytest.mark.asyncio
+async def test_set_many():
+    """Verify SET over several entities makes one set_states call"""
+
+    class BulkInterpreter(Interpreter):
+
+        def __init__(self):
+            super().__init__()
+            self.bulk = []
+
+        async def set_states(self, entity_names, **kwargs):
+            self.bulk.append(entity_names)
+            return await super().set_states(entity_names, **kwargs)
+
+    bulk = BulkInterpreter()
+    OttoBase.set_context(OttoContext(interpreter=bulk))
+
+    n = Set().parse_string('set (ship.crew, ship.cargo) to 15')[0]
+    results = await n.eval()
+
+    assert bulk.bulk == [['ship.crew', 'ship.cargo']]
+    assert [r['entity_name'] for r in results] == ['ship.crew', 'ship.cargo']
+
+    # A single target still goes through set_state.
+    n = Set().parse_string('set ship.crew to 16')[0]
+    assert (await n.eval())[0]['value'] == 16
+    assert len(bulk.bulk) == 1
+
+    OttoBase.set_context()
+
+
 @pytest.mark.asyncio
 async def test_turn():
 
@@ -243,3 +275,11 @@ async def test_wait():
     assert await n1.eval() == expected1
     assert await n2.eval() == expected2
     assert await n3.eval() == expected3
+
+    # A var can stand in for the time.
+    ctx = OttoContext()
+    OttoBase.set_context(ctx)
+    ctx.update_vars({'@delay': RelativeTime().parse_string("2 MINUTES")[0]})
+    n4 = Wait().parse_string("WAIT @delay")[0]
+
+    assert await n4.eval() == 2 * 60
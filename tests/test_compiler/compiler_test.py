@@ -0,0 +1,178 @@
+import pytest
+from functools import partial
+from ottoscript import vm
+from ottoscript.compiler import Compiler, assemble, compile_auto
+from ottoscript.controls import Auto
+from ottoscript.datatypes import Entity
+from ottoscript.interpreters import Interpreter
+from ottoscript.ottobase import OttoBase, OttoContext
+
+SOURCE = """@level = 40
+            @lights = (light.porch, light.hall)
+            @area_shortcuts = (upstairs="bedroom")
+
+            AUTO compiled_test
+            WHEN light.a CHANGES
+            @local = 'set'
+            IF light.a == 'light.a' AND (5 > 1 OR NOT @local == 'set')
+                TURN ON LIGHT light.b WITH (brightness=@level, kelvin=2700)
+                DIM @lights TO @level%
+                SET input_text.mode TO @local
+                WAIT 00:00:05
+            ELSE
+                PASS
+            END
+            SWITCH
+                CASE light.a:brightness > 5
+                    LOCK lock.front_door
+                CASE 1 == 1
+                    TOGGLE switch AREA upstairs
+                DEFAULT
+                    PASS
+            END
+            CLOSE cover.garage TO 30
+            CALL scene.turn_on ON scene.evening
+            """
+
+
+class Recorder:
+    """Logger and interpreter that remember every call"""
+
+    def __init__(self):
+        self.calls = []
+
+    def set_task(self, task):
+        pass
+
+    async def info(self, message):
+        self.calls.append(('info', message))
+
+    async def debug(self, message):
+        self.calls.append(('debug', message))
+
+    async def error(self, message):
+        self.calls.append(('error', message))
+
+    async def warning(self, message):
+        self.calls.append(('warning', message))
+
+
+class RecordingInterpreter(Interpreter):
+
+    async def get_state(self, entity_name):
+        self.log.calls.append(('get_state', entity_name))
+        return await super().get_state(entity_name)
+
+    async def call_service(self, domain, service_name, **kwargs):
+        self.log.calls.append(('call_service', domain, service_name, kwargs))
+        return await super().call_service(domain, service_name, **kwargs)
+
+
+def recorded_context(**kwargs):
+    log = Recorder()
+    return OttoContext(interpreter=RecordingInterpreter(logger=log),
+                       logger=log, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_compiled_matches_eval():
+    """Verify compiled actions make the same calls as eval()"""
+
+    OttoBase.set_context(recorded_context())
+    auto = Auto.parse(SOURCE)
+    await auto.actions.eval()
+    expected = auto.ctx.log.calls
+
+    ctx = recorded_context()
+    auto.bind(ctx)
+    await compile_auto(auto)()
+
+    assert ctx.log.calls == expected
+    assert ('call_service', 'light', 'turn_on',
+            {'brightness_pct': 40.0,
+             'entity_id': ['light.porch', 'light.hall'],
+             'area_id': []}) in expected
+
+    OttoBase.set_context()
+
+
+@pytest.mark.asyncio
+async def test_compiler_respects_eval_overrides():
+    """Verify subclasses that override eval() keep their own eval"""
+
+    class Constant(Entity):
+        __slots__ = ()
+
+        async def eval(self, attribute=None):
+            return 'constant'
+
+    OttoBase.set_context()
+    node = Entity().parse_string("light.a")[0]
+    node.__class__ = Constant
+
+    assert await Compiler().compile(node)() == 'constant'
+
+
+@pytest.mark.asyncio
+async def test_vm_matches_eval():
+    """Verify lowered code makes the same calls as eval()"""
+
+    OttoBase.set_context(recorded_context())
+    auto = Auto.parse(SOURCE)
+    await auto.actions.eval()
+    expected = auto.ctx.log.calls
+
+    ctx = recorded_context()
+    auto.bind(ctx)
+    code = assemble(auto)
+
+    assert await vm.run(code) is None
+    assert ctx.log.calls == expected
+
+    # Registers are fresh for every run.
+    ctx.log.calls.clear()
+    await vm.run(code)
+    assert ctx.log.calls == expected
+
+    OttoBase.set_context()
+
+
+@pytest.mark.asyncio
+async def test_batched_blocks_match_eval():
+    """Verify batched blocks make the same calls however they're run"""
+
+    for policy in ({'parallel': True}, {'coalesce': True}):
+        OttoBase.set_context(recorded_context(**policy))
+        auto = Auto.parse(SOURCE)
+        await auto.actions.eval()
+        expected = auto.ctx.log.calls
+
+        for run in (compile_auto,
+                    lambda auto: partial(vm.run, assemble(auto))):
+            ctx = recorded_context(**policy)
+            auto.bind(ctx)
+            await run(auto)()
+            assert ctx.log.calls == expected
+
+    OttoBase.set_context()
+
+
+@pytest.mark.asyncio
+async def test_disassemble():
+    """Verify the listing names each instruction and marks jump targets"""
+
+    OttoBase.set_context()
+    auto = Auto.parse("""AUTO listing WHEN light.a CHANGES
+                         IF light.a == 'on'
+                             TURN ON LIGHT light.b
+                         ELSE
+                             PASS
+                         END""")
+    listing = vm.disassemble(assemble(auto)).splitlines()
+
+    instructions = [line for line in listing if not line.startswith("#")]
+    assert len(instructions) == len(assemble(auto))
+    assert any(line.split()[1:] == ["LOAD_STATE", "r1,", "'light.a'"]
+               for line in instructions)
+    assert "# TURN ON LIGHT light.b" in listing
+    assert any(line.startswith(">>") for line in listing)
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from collections import Counter
 from ottoscript.conditionals import (
@@ -9,6 +10,7 @@ from ottoscript.conditionals import (
 )
 from ottoscript.interpreters import Interpreter
 from ottoscript.ottobase import OttoContext, OttoBase
+from ottoscript.runtime import current_run
 from ottoscript.datatypes import String
 
 interpreter = Interpreter()
@@ -85,7 +87,8 @@ async def test_condition():
     tests = [("light.cupola_lights == 'light.cupola_lights'", True),
              ("10 > 5 AND 'string' == 'string'", True),
              ("5 > 10 OR (10 > 5 AND 'string' == 'string')", True),
-             ("'foobar' < 'foo'", False)]
+             ("'foobar' < 'foo'", False),
+             ("NOT 5 > 10", True)]
 
     for t in tests:
         n = Condition().parse_string(t[0])[0]
@@ -158,3 +161,226 @@ async def test_switch():
         n = Switch().parse_string(t[0])[0]
         x = await n.eval()
         assert x == t[1]
+
+
+@pytest.mark.asyncio
+async def test_nested_switch():
+    """Verify a SWITCH can be nested inside an IF"""
+
+    n = IfThenElse().parse_string(
+        """IF 5 > 10
+              WAIT 30 seconds
+           ELSE SWITCH
+              CASE 10 > 5
+                 WAIT 60 seconds
+              END
+           END""")[0]
+
+    assert await n.eval() == 1
+
+
+@pytest.mark.asyncio
+async def test_condition_short_circuits():
+    """Verify AND/OR/NOT stop once the result is settled"""
+
+    class CountingInterpreter(Interpreter):
+        fetched = []
+
+        async def get_state(self, entity_name):
+            self.fetched.append(entity_name)
+            return await super().get_state(entity_name)
+
+    ctx = OttoContext(interpreter=CountingInterpreter())
+    ctx.update_vars({"@a": String().parse_string("'y'")[0]})
+    OttoBase.set_context(ctx)
+
+    strings = [("@a == 'x' AND sensor.slow:attr > 5", False, 1),
+               ("@a == 'y' OR sensor.slow == 'on'", True, 1),
+               ("NOT (@a == 'x' AND sensor.slow == 'on')", True, 1),
+               ("(1 == 2 AND sensor.a == 'on') OR 1 == 1", True, 1),
+               ("1 == 1 AND sensor.a == 'sensor.a'", True, 0)]
+
+    for string, expected, skipped in strings:
+        ctx.counters.clear()
+        n = Condition().parse_string(string)[0]
+        assert await n.eval() is expected
+        assert ctx.counters['skipped_fetches'] == skipped
+
+    assert CountingInterpreter.fetched == ['sensor.a']
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reads():
+    """Verify concurrent mode reads every state at once, up to the limit"""
+
+    class SlowInterpreter(Interpreter):
+        def __init__(self):
+            super().__init__()
+            self.active = 0
+            self.peak = 0
+            self.reads = Counter()
+
+        async def get_state(self, entity_name):
+            self.reads[entity_name] += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            await asyncio.sleep(0.01)
+            self.active -= 1
+            return 'off'
+
+    string = ("sensor.a == 'on' OR sensor.b == 'on'"
+              " OR sensor.c == 'on' OR sensor.d == 'on'")
+
+    for limit, peak in ((True, 4), (2, 2), (False, 1)):
+        interpreter = SlowInterpreter()
+        OttoBase.set_context(OttoContext(interpreter=interpreter,
+                                         concurrency=limit))
+        n = Condition().parse_string(string)[0]
+
+        assert await n.eval() is False
+        assert interpreter.peak == peak
+        assert interpreter.reads == Counter(['sensor.a', 'sensor.b',
+                                             'sensor.c', 'sensor.d'])
+
+    # Every CASE head is read up front, once.
+    interpreter = SlowInterpreter()
+    OttoBase.set_context(OttoContext(interpreter=interpreter,
+                                     concurrency=True))
+    n = Switch().parse_string("""SWITCH
+                                 CASE sensor.a == 'on' PASS
+                                 CASE sensor.b == 'on' PASS
+                                 CASE sensor.a == 'off' PASS
+                                 END""")[0]
+
+    assert await n.eval() == 3
+    assert interpreter.peak == 2
+    assert interpreter.reads == Counter(['sensor.a', 'sensor.b'])
+
+
+@pytest.mark.asyncio
+async def test_parallel_block():
+    """Verify parallel blocks start independent commands together"""
+
+    class SlowInterpreter(Interpreter):
+        def __init__(self):
+            super().__init__()
+            self.active = 0
+            self.peak = 0
+
+        async def call_service(self, domain, service_name, **kwargs):
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            await asyncio.sleep(0.01)
+            self.active -= 1
+            if service_name == 'fail':
+                raise RuntimeError(kwargs['entity_id'])
+            return kwargs.get('entity_id')
+
+    string = """TURN ON light light.porch
+                TURN ON light light.hall
+                UNLOCK lock.front_door
+                TURN OFF light light.porch
+                SET input_number.level = light.hall:brightness
+                @group = light.den
+                TURN ON light @group
+                TURN ON light AREA kitchen
+                CALL light.turn_on ON light.study
+                CALL scene.turn_on
+                """
+
+    interpreter = SlowInterpreter()
+    ctx = OttoContext(interpreter=interpreter, parallel=True)
+    OttoBase.set_context(ctx)
+    n = CommandBlock().parse_string(string)[0]
+
+    assert list(n.batches()) == [[0, 1, 2], [3, 4], [5], [6, 7], [8], [9]]
+
+    results = await n.eval()
+    assert interpreter.peak == 3
+    assert results[:4] == [['light.porch'], ['light.hall'],
+                           ['lock.front_door'], ['light.porch']]
+    assert results[6:] == [['light.den'], [], ['light.study'], None]
+
+    # TURN ON light AREA kitchen could reach light.study.
+    n = CommandBlock().parse_string("TURN ON light AREA kitchen"
+                                    " TURN OFF light light.study"
+                                    " LOCK lock.front_door")[0]
+    assert list(n.batches()) == [[0], [1, 2]]
+
+    # @target is only known once the assignment has run.
+    interpreter.calls = []
+    original = interpreter.call_service
+
+    async def call_service(domain, service_name, **kwargs):
+        interpreter.calls.append((interpreter.active, kwargs['entity_id']))
+        return await original(domain, service_name, **kwargs)
+
+    interpreter.call_service = call_service
+    n = CommandBlock().parse_string("@target = light.porch"
+                                    " TURN ON light light.porch"
+                                    " TOGGLE light @target")[0]
+    await n.eval()
+    assert interpreter.calls == [(0, ['light.porch']), (0, ['light.porch'])]
+
+    n = CommandBlock().parse_string("TURN ON light light.porch"
+                                    " CALL light.fail ON light.hall")[0]
+    with pytest.raises(RuntimeError, match='light.hall'):
+        await n.eval()
+
+
+@pytest.mark.asyncio
+async def test_coalesced_calls():
+    """Verify runs of the same service call are made as one call"""
+
+    class RecordingInterpreter(Interpreter):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        async def call_service(self, domain, service_name, **kwargs):
+            self.calls.append((domain, service_name, kwargs))
+            return len(self.calls)
+
+    string = """TURN ON light light.porch
+                TURN ON light light.hall
+                TURN ON light AREA kitchen
+                DIM light.den TO 60%
+                DIM light.study TO 60%
+                WAIT 00:00:01
+                TOGGLE light light.porch
+                TOGGLE light light.porch
+                TURN ON light light.hall WITH (brightness=light.den:brightness)
+                TURN ON light light.den
+                """
+
+    interpreter = RecordingInterpreter()
+    ctx = OttoContext(interpreter=interpreter, coalesce=True)
+    OttoBase.set_context(ctx)
+    n = CommandBlock().parse_string(string)[0]
+
+    assert list(n.batches()) == [[0, 1, 2, 3, 4], [5], [6, 7], [8], [9]]
+
+    with ctx.run():
+        results = await n.eval()
+        assert current_run.get().coalesced == 2
+
+    assert interpreter.calls[:3] == [
+        ('light', 'turn_on', {'entity_id': ['light.porch', 'light.hall'],
+                              'area_id': []}),
+        ('light', 'turn_on', {'entity_id': [],
+                              'area_id': ['kitchen']}),
+        ('light', 'turn_on', {'entity_id': ['light.den', 'light.study'],
+                              'area_id': [],
+                              'brightness_pct': 60.0})
+    ]
+    assert results[:5] == [1, 1, 2, 3, 3]
+    assert results[6:8] == [4, 5]
+    assert len(interpreter.calls) == 7
+    assert ctx.counters['coalesced_calls'] == 2
+
+    # An entity in the area would be toggled once instead of twice.
+    interpreter.calls.clear()
+    n = CommandBlock().parse_string("TOGGLE light light.kitchen_ceiling"
+                                    " TOGGLE light AREA kitchen")[0]
+    await n.eval()
+    assert len(interpreter.calls) == 2
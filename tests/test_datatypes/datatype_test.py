@@ -1,5 +1,6 @@
 import pytest
 from collections import Counter
+from pyparsing import ParseException
 from ottoscript.ottobase import OttoBase, OttoContext
 from ottoscript.datatypes import (Number,
                                   String,
@@ -238,3 +239,75 @@ async def test_input():
         print(test["string"])
         result = await n.eval()
         assert result == test["expected"]
+
+
+@pytest.mark.asyncio
+async def test_entity_rejects_reserved_words():
+    """Verify reserved words can't be used as a domain or id"""
+
+    OttoBase.set_context()
+    assert Entity().parse_string("light.tomorrow")[0].id == "tomorrow"
+
+    for string in ("to.kitchen", "light.When", "AREA.kitchen"):
+        with pytest.raises(ParseException):
+            Entity().parse_string(string)
+
+
+@pytest.mark.asyncio
+async def test_target_folds_constant_vars():
+    """Verify targets fed only by globals are resolved once per change"""
+
+    ctx = OttoContext()
+    lights = List(Entity()).parse_string('light.a, light.b')[0]
+    ctx.update_global_vars({'@lights': lights})
+    OttoBase.set_context(ctx)
+
+    n = Target().parse_string('@lights, light.c')[0]
+    n.resolve()
+    frozen = n.ids()
+
+    expected = {'entity_id': ['light.a', 'light.b', 'light.c'],
+                'area_id': []}
+    assert await n.eval() == expected
+    assert n.ids() is frozen
+
+    # Reassigning the global is picked up.
+    other = List(Entity()).parse_string('light.d')[0]
+    ctx.update_global_vars({'@lights': other})
+    assert (await n.eval())['entity_id'] == ['light.d', 'light.c']
+
+    # Once a local shadows the name it is looked up on every run.
+    ctx.update_vars({'@lights': lights})
+    assert (await n.eval())['entity_id'] == ['light.a', 'light.b', 'light.c']
+    assert n.ids() is not n.ids()
+    ctx.update_vars({'@lights': other})
+    assert (await n.eval())['entity_id'] == ['light.d', 'light.c']
+
+
+@pytest.mark.asyncio
+async def test_area_shortcuts():
+    """Verify area shortcuts expand transitively and reject cycles"""
+
+    ctx = OttoContext()
+    ctx.update_global_vars({
+        'area_shortcuts': {'house': ['upstairs', 'kitchen'],
+                           'upstairs': ['bedroom', 'landing']}
+    })
+    OttoBase.set_context(ctx)
+
+    n = Target().parse_string('AREA house, garage')[0]
+    assert (await n.eval())['area_id'] == ['bedroom', 'landing',
+                                           'kitchen', 'garage']
+
+    with pytest.raises(ValueError, match="upstairs -> landing -> upstairs"):
+        ctx.update_global_vars({
+            'area_shortcuts': {'upstairs': ['bedroom', 'landing'],
+                               'landing': ['upstairs']}
+        })
+
+    # A rejected assignment leaves the old shortcuts in place.
+    assert (await n.eval())['area_id'] == ['bedroom', 'landing',
+                                           'kitchen', 'garage']
+
+    ctx.update_vars({'area_shortcuts': {'house': ['hall']}})
+    assert (await n.eval())['area_id'] == ['hall', 'garage']
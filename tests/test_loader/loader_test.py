@@ -0,0 +1,95 @@
+import pytest
+from pyparsing import ParseException
+from ottoscript.interpreters import PrintLogger, Registrar, pyscript_registry
+from ottoscript.loader import IncrementalLoader, load_files
+from ottoscript.ottobase import OttoBase, OttoContext
+
+AUTOS = {
+    "lights_on": "AUTO lights_on WHEN 08:00 TURN ON LIGHT light.office",
+    "lights_off": "AUTO lights_off WHEN 17:00 TURN OFF LIGHT light.office",
+    "lock_up": "AUTO lock_up WHEN 22:00 LOCK lock.front_door",
+}
+
+
+def source(*blocks):
+    return "\n;\n".join(blocks) + "\n;\n"
+
+
+@pytest.mark.asyncio
+async def test_incremental_reload():
+    """Verify only added, changed and removed blocks are re-registered"""
+
+    OttoBase.set_context(OttoContext(logger=PrintLogger('loader_test')))
+    registrar = Registrar(PrintLogger('loader_test'))
+    loader = IncrementalLoader(registrar)
+
+    report = await loader.load(source(AUTOS["lights_on"],
+                                      AUTOS["lights_off"]))
+    assert report.added == ["lights_on", "lights_off"]
+
+    unchanged = pyscript_registry[("loader_test", "lights_on")]
+    changed = AUTOS["lights_off"].replace("17:00", "18:00")
+    report = await loader.load(source(AUTOS["lights_on"],
+                                      changed,
+                                      AUTOS["lock_up"]))
+
+    assert report.as_dict() == {
+        'added': ["lock_up"],
+        'changed': ["lights_off"],
+        'removed': [],
+        'unchanged': ["lights_on"]
+    }
+    assert pyscript_registry[("loader_test", "lights_on")] is unchanged
+    assert len(pyscript_registry[("loader_test", "lights_off")]) == 1
+
+    report = await loader.load(source(AUTOS["lock_up"]))
+
+    assert report.removed == ["lights_on", "lights_off"]
+    assert report.unchanged == ["lock_up"]
+    assert ("loader_test", "lights_on") not in pyscript_registry
+    assert list(registrar.registry["loader_test"]) == ["lock_up"]
+
+    # A block that fails to parse leaves the last load registered.
+    with pytest.raises(ParseException):
+        await loader.load(source(AUTOS["lights_on"],
+                                 "AUTO broken WHEN 08:00 TURN ON"))
+
+    assert ("loader_test", "lights_on") not in pyscript_registry
+    assert list(registrar.registry["loader_test"]) == ["lock_up"]
+    assert [auto.controls.name for auto in loader.autos] == ["lock_up"]
+
+
+@pytest.mark.asyncio
+async def test_load_files(tmp_path):
+    """Verify files parsed in worker processes are bound to their context"""
+
+    OttoBase.set_context()
+    paths = []
+    for n, name in enumerate(AUTOS):
+        path = tmp_path / f"{name}.otto"
+        path.write_text(f"@file = 'file_{n}'\n" + source(AUTOS[name]))
+        paths.append(path)
+
+    contexts = {path: OttoContext() for path in paths}
+    results = load_files(paths, context=contexts.get, max_workers=2)
+
+    for n, path in enumerate(paths):
+        ctx = contexts[path]
+        auto, = results[path]
+
+        assert auto.controls.name == list(AUTOS)[n]
+        assert all(node.ctx is ctx for node in auto.walk())
+        assert ctx.global_vars["@file"]._value == f"file_{n}"
+
+
+def test_load_files_without_context(tmp_path, monkeypatch):
+    """Verify load_files works before any class-level context is set"""
+
+    monkeypatch.delattr(OttoBase, 'context', raising=False)
+    path = tmp_path / "lights_on.otto"
+    path.write_text(source(AUTOS["lights_on"]))
+
+    ctx = OttoContext()
+    auto, = load_files([path], context=ctx, max_workers=1)[path]
+
+    assert all(node.ctx is ctx for node in auto.walk())
@@ -0,0 +1,179 @@
+import asyncio
+import pytest
+from ottoscript.conditionals import CommandBlock, Condition
+from ottoscript.interpreters import Interpreter, PrintLogger
+from ottoscript.logs import LogBuffer, QueueLogger, is_enabled, log_lazy
+from ottoscript.ottobase import OttoBase, OttoContext
+
+
+class LevelLogger:
+
+    def __init__(self, level):
+        self.level = level
+        self.messages = []
+
+    def set_task(self, task):
+        pass
+
+    def is_enabled(self, level):
+        return level in self.level
+
+    async def info(self, message):
+        self.messages.append(('info', message))
+
+    async def error(self, message):
+        self.messages.append(('error', message))
+
+    async def warning(self, message):
+        self.messages.append(('warning', message))
+
+    async def debug(self, message):
+        self.messages.append(('debug', message))
+
+
+class Unprintable:
+
+    def __str__(self):
+        raise AssertionError("formatted a message that was off")
+
+
+@pytest.mark.asyncio
+async def test_is_enabled():
+    """Verify levels are checked before messages are built"""
+
+    log = LevelLogger(level=('info',))
+    assert is_enabled(log, 'info')
+    assert not is_enabled(log, 'debug')
+
+    await log_lazy(log, 'debug', "{}", Unprintable())
+    await log_lazy(log, 'info', "state of {}", 'light.porch')
+    assert log.messages == [('info', 'state of light.porch')]
+
+    # Loggers without is_enabled get everything.
+    assert is_enabled(object(), 'debug')
+    assert not PrintLogger().is_enabled('debug')
+    assert PrintLogger(debug_as_info=True).is_enabled('debug')
+
+
+@pytest.mark.asyncio
+async def test_disabled_levels_skip_messages():
+    """Verify evaluation logs nothing at levels that are off"""
+
+    for level, count in (((), 0), (('info',), 5)):
+        log = LevelLogger(level=level)
+        OttoBase.set_context(
+            OttoContext(interpreter=Interpreter(logger=log), logger=log))
+
+        n = Condition().parse_string("light.porch == 'on'")[0]
+        await n.eval()
+        n = CommandBlock().parse_string("TURN ON light light.porch"
+                                        " PASS")[0]
+        await n.eval()
+
+        # Fetch, comparison and condition, then one line per command.
+        assert len(log.messages) == count
+
+    OttoBase.set_context()
+
+
+@pytest.mark.asyncio
+async def test_queue_logger():
+    """Verify queued lines are written in batches by a background task"""
+
+    batches = []
+    buffer = LogBuffer(batches.append, batch_size=2)
+    log = QueueLogger(buffer, task='porch_lights')
+
+    await log.info("one")
+    await log.debug("hidden")
+    await log.warning("two")
+    await log.error("three")
+
+    # Nothing is written until the loop gets to the flush task.
+    assert batches == []
+    await asyncio.sleep(0)
+    assert batches == [['INFO: otto porch_lights one',
+                        'WARNING: otto porch_lights two'],
+                       ['ERROR: otto porch_lights three']]
+
+    await buffer.close()
+    assert buffer.written == 3
+
+
+@pytest.mark.asyncio
+async def test_queue_logger_drops_oldest():
+    """Verify a full buffer drops its oldest lines"""
+
+    batches = []
+    buffer = LogBuffer(batches.append, capacity=3)
+    log = QueueLogger(buffer, log_id='test', task='storm')
+
+    for i in range(5):
+        await log.info(i)
+
+    await buffer.close()
+    assert batches == [['INFO: test storm 2',
+                        'INFO: test storm 3',
+                        'INFO: test storm 4']]
+    assert buffer.dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_queue_logger_rate_limit(tmp_path):
+    """Verify one automation's log storm can't crowd out the others"""
+
+    now = [0.0]
+    path = str(tmp_path / "otto.log")
+    buffer = LogBuffer(path)
+    log = QueueLogger(buffer, task='loader', rate=2, clock=lambda: now[0])
+    ctx = OttoContext()
+
+    # One logger is shared by every automation in a context.
+    with ctx.run(('otto', 'storm')):
+        for i in range(10):
+            await log.info(i)
+    with ctx.run(('otto', 'quiet')):
+        await log.info("still here")
+
+    now[0] += 1.0
+    with ctx.run(('otto', 'storm')):
+        await log.info("again")
+
+    await buffer.close()
+    with open(path) as f:
+        assert f.read().splitlines() == [
+            'INFO: otto storm 0',
+            'INFO: otto storm 1',
+            'INFO: otto quiet still here',
+            'WARNING: otto storm dropped 8 lines',
+            'INFO: otto storm again'
+        ]
+
+
+@pytest.mark.asyncio
+async def test_queue_logger_sink_errors():
+    """Verify a sink that raises loses a batch, not the drain task"""
+
+    batches = []
+
+    def sink(batch):
+        if batch == ['INFO: otto porch bad']:
+            raise OSError("disk full")
+        batches.append(batch)
+
+    buffer = LogBuffer(sink)
+    log = QueueLogger(buffer, task='porch')
+
+    await log.info("bad")
+    await asyncio.sleep(0)
+    for i in range(3):
+        await log.info(i)
+    await asyncio.sleep(0)
+
+    assert not buffer.task.done()
+    assert batches == [['INFO: otto porch 0',
+                        'INFO: otto porch 1',
+                        'INFO: otto porch 2']]
+    assert buffer.errors == 1
+
+    await buffer.close()
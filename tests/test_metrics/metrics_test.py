@@ -0,0 +1,82 @@
+import pytest
+from ottoscript.conditionals import CommandBlock, IfThenElse
+from ottoscript.interpreters import Interpreter
+from ottoscript.metrics import Histogram, MetricsRegistry
+from ottoscript.ottobase import OttoBase, OttoContext
+
+
+class FailingInterpreter(Interpreter):
+
+    async def call_service(self, domain, service_name, **kwargs):
+        if service_name == 'fail':
+            raise RuntimeError("backend down")
+        return await super().call_service(domain, service_name, **kwargs)
+
+
+def test_histogram():
+    """Verify observations land in fixed, cumulative buckets"""
+
+    h = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        h.observe(value)
+
+    assert h.counts == [2, 1, 1]
+    assert h.cumulative() == [(0.1, 2), (1.0, 3), (float('inf'), 4)]
+    assert h.as_dict() == {'buckets': {'0.1': 2, '1.0': 3, '+Inf': 4},
+                           'sum': 3.65,
+                           'count': 4}
+
+
+@pytest.mark.asyncio
+async def test_run_metrics():
+    """Verify named runs report runs, backend calls and conditions"""
+
+    registry = MetricsRegistry(buckets=(0.5, 1.0))
+    ctx = OttoContext(interpreter=FailingInterpreter(), metrics=registry)
+    OttoBase.set_context(ctx)
+    key = ('test', 'porch')
+
+    n = IfThenElse().parse_string("""IF light.porch == 'light.porch'
+                                         TURN ON light light.hall
+                                         SET input_text.mode TO 'on'
+                                     END""")[0]
+    miss = IfThenElse().parse_string("""IF light.porch == 'on'
+                                            PASS
+                                        END""")[0]
+    fail = CommandBlock().parse_string("CALL light.fail ON light.hall")[0]
+
+    for node in (n, miss, n):
+        with ctx.run(key):
+            await node.eval()
+
+    with pytest.raises(RuntimeError):
+        with ctx.run(key):
+            await fail.eval()
+
+    # Runs without a name aren't counted.
+    with ctx.run():
+        await n.eval()
+
+    metrics = registry.as_dict()[key]
+    assert metrics['runs'] == {'started': 4, 'finished': 3, 'failed': 1}
+    assert metrics['run_seconds']['count'] == 4
+    assert metrics['calls'] == {'get_state': 3,
+                                'set_state': 2,
+                                'call_service': 3}
+    assert metrics['call_seconds']['get_state']['buckets']['+Inf'] == 3
+    assert metrics['conditions'] == {'true': 2,
+                                     'false': 1,
+                                     'true_ratio': 2 / 3}
+
+    text = registry.to_prometheus()
+    assert "# TYPE ottoscript_run_seconds histogram" in text
+    assert ('ottoscript_runs_failed_total{namespace="test",name="porch"} 1'
+            in text)
+    assert ('ottoscript_backend_call_seconds_count{namespace="test",'
+            'name="porch",call="call_service"} 3' in text)
+    assert ('ottoscript_run_seconds_bucket{namespace="test",name="porch",'
+            'le="+Inf"} 4' in text)
+    assert ('ottoscript_conditions_total{namespace="test",name="porch",'
+            'result="true"} 2' in text)
+
+    OttoBase.set_context()
@@ -0,0 +1,180 @@
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from ottoscript.ottobase import (OttoBase,
+                                 OttoContext,
+                                 grammar_registry,
+                                 packrat_mode,
+                                 packrat_stats)
+from ottoscript.datatypes import Entity, List, Input, Var
+from ottoscript.controls import Auto
+
+
+@pytest.mark.asyncio
+async def test_grammar_registry_reuses_parsers():
+    """Verify each (class, args) parser is built only once"""
+
+    assert Entity() is Entity()
+    assert Input("numeric") is Input("numeric")
+    assert Input("numeric") is not Input("text")
+    assert Auto() is Auto()
+
+    content = Entity()
+    assert List(content) is List(content)
+
+
+@pytest.mark.asyncio
+async def test_grammar_registry_stats():
+    """Verify the registry reports builds, hits and element counts"""
+
+    before = grammar_registry.stats()
+    Auto()
+    after = grammar_registry.stats()
+
+    assert after['builds'] == before['builds']
+    assert after['hits'] == before['hits'] + 1
+    assert after['parsers'] > 0
+    assert after['elements'] >= after['parsers']
+    assert after['builds_by_class']['Auto'] == 1
+
+
+@pytest.mark.asyncio
+async def test_shared_parser_still_parses():
+    """Verify reused parsers create fresh nodes on every parse"""
+
+    OttoBase.set_context()
+    first = Entity().parse_string("light.office")[0]
+    second = Entity().parse_string("light.kitchen")[0]
+
+    assert first is not second
+    assert first.name == "light.office"
+    assert second.name == "light.kitchen"
+
+
+@pytest.mark.asyncio
+async def test_packrat_parse():
+    """Verify packrat parsing gives the same tree and is switched off after"""
+
+    source = """AUTO packrat_test
+                WHEN light.a CHANGES
+                IF light.a == 'on' AND (5 > 1 OR NOT 'a' == 'b')
+                    TURN ON LIGHT light.b
+                ELSE
+                    PASS
+                END"""
+
+    OttoBase.set_context()
+    plain = Auto.parse(source)
+    cached = Auto.parse(source, packrat=True)
+
+    assert not packrat_stats()['enabled']
+    assert cached.controls.name == plain.controls.name
+    assert (await cached.actions.clauses[0].conditions.eval()
+            == await plain.actions.clauses[0].conditions.eval())
+
+    OttoBase.set_context(OttoContext(packrat=64))
+    with packrat_mode(64):
+        Auto().parse_string(source)
+        assert packrat_stats()['enabled']
+        assert packrat_stats()['misses'] > 0
+
+    assert not packrat_stats()['enabled']
+
+
+# Importing ottoscript itself may take at most this share of the time
+# its dependencies take to import, so the check scales with the machine.
+IMPORT_RATIO = 1.0
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import asyncio, concurrent.futures, hashlib, inspect, mmap, pickle, pathlib
+import pyparsing
+baseline = time.perf_counter() - start
+start = time.perf_counter()
+import ottoscript.controls
+elapsed = time.perf_counter() - start
+from ottoscript.ottobase import grammar_registry
+print(elapsed, baseline, grammar_registry.stats()['builds'])
+"""
+
+
+def test_import_budget():
+    """Verify importing the grammar modules builds no grammar"""
+
+    root = Path(__file__).parents[2]
+    ratios = []
+
+    for _ in range(3):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT],
+                                cwd=root,
+                                capture_output=True,
+                                text=True,
+                                check=True).stdout
+        elapsed, baseline, builds = output.split()
+        assert builds == "0"
+        ratios.append(float(elapsed) / float(baseline))
+
+    assert min(ratios) < IMPORT_RATIO
+
+
+@pytest.mark.asyncio
+async def test_compact_nodes():
+    """Verify nodes use slots and compact mode releases the parse results"""
+
+    source = """AUTO compact_test
+                WHEN light.a CHANGES
+                IF light.a == 'on'
+                    TURN ON LIGHT light.b
+                END"""
+
+    OttoBase.set_context()
+    auto = Auto.parse(source)
+    assert all(not hasattr(node, '__dict__') for node in auto.walk())
+    assert auto.tokens is not None
+
+    OttoBase.set_context(OttoContext(compact=True))
+    auto = Auto.parse(source)
+    condition = auto.actions.clauses[0].conditions
+
+    assert all(not hasattr(node, 'tokens') for node in auto.walk())
+    assert all(not hasattr(node, 'parse_results') for node in auto.walk())
+    assert "light.a == 'on'" in str(condition)
+    assert auto.controls.name == "compact_test"
+
+    OttoBase.set_context()
+
+
+@pytest.mark.asyncio
+async def test_copy_keeps_context():
+    """Verify copies of a bound node stay on the node's context"""
+
+    OttoBase.set_context()
+    ctx = OttoContext()
+    ctx.update_vars({"@lamp": Entity().parse_string("light.porch")[0]})
+
+    var = Var().parse_string("@lamp:brightness")[0]
+    var.bind(ctx)
+    ctx.get_var("@lamp").bind(ctx)
+
+    entity = var.fetch()
+    assert entity.attribute == "brightness"
+    assert entity.ctx is ctx
+
+
+def test_class_ctx_alias():
+    """Verify OttoBase.ctx still reads and sets the class-level context"""
+
+    ctx = OttoContext()
+    OttoBase.ctx = ctx
+    assert OttoBase.context is ctx
+    assert Auto.ctx is ctx
+
+    node = Entity().parse_string("light.porch")[0]
+    other = OttoContext()
+    node.ctx = other
+    assert node.ctx is other
+    assert OttoBase.ctx is ctx
+
+    OttoBase.set_context()
@@ -0,0 +1,90 @@
+import io
+import pytest
+from pyparsing import ParseException
+from ottoscript.cache import CompiledCache
+from ottoscript.ottobase import OttoBase
+from ottoscript.program import Program
+
+SOURCE = """@working = input_boolean.working
+
+AUTO work_start
+  WHEN 08:00 on WEEKDAY
+    SET @working TO 'on;off'
+;
+
+AUTO work_end
+  WHEN 17:00 on WEEKDAY
+    SET @working TO 'off'
+;
+"""
+
+
+@pytest.mark.asyncio
+async def test_program_from_string():
+    """Verify blocks are split on ';' outside of quotes"""
+
+    OttoBase.set_context()
+    autos = list(Program(SOURCE))
+
+    assert [a.controls.name for a in autos] == ["work_start", "work_end"]
+    for auto in autos:
+        start, end = auto.span
+        assert f"AUTO {auto.controls.name}" in SOURCE[start:end]
+
+
+@pytest.mark.asyncio
+async def test_program_is_lazy():
+    """Verify later blocks aren't parsed before they are requested"""
+
+    OttoBase.set_context()
+    autos = Program(SOURCE + "AUTO broken WHEN ;")
+
+    assert next(iter(autos)).controls.name == "work_start"
+
+
+@pytest.mark.asyncio
+async def test_program_rejects_trailing_text(tmp_path):
+    """Verify text after a block's automation is an error"""
+
+    OttoBase.set_context()
+    source = SOURCE.replace("'off'\n;", "'off'\n  TURN ON\n;")
+
+    with pytest.raises(ParseException):
+        list(Program(source))
+
+    with pytest.raises(ParseException):
+        list(Program(source, cache=CompiledCache(tmp_path)))
+
+
+@pytest.mark.asyncio
+async def test_program_from_path_and_file(tmp_path):
+    """Verify paths (mapped or read) and file objects give the same spans"""
+
+    OttoBase.set_context()
+    path = tmp_path / "work.otto"
+    path.write_text(SOURCE)
+    expected = [a.span for a in Program(SOURCE)]
+
+    assert [a.span for a in Program(path)] == expected
+    assert [a.span for a in Program(path, mmap_threshold=1)] == expected
+    assert [a.span for a in Program(io.StringIO(SOURCE))] == expected
+
+    with open(path, "rb") as file:
+        assert [a.span for a in Program(file, mmap_threshold=1)] == expected
+
+
+@pytest.mark.asyncio
+async def test_program_spans_are_characters(tmp_path):
+    """Verify files with non-ASCII text give the same spans as the text"""
+
+    OttoBase.set_context()
+    source = SOURCE.replace("'on;off'", "'Büro – an;aus'")
+    path = tmp_path / "büro.otto"
+    path.write_text(source, encoding="utf-8")
+    expected = [a.span for a in Program(source)]
+
+    assert [a.span for a in Program(path)] == expected
+    assert [a.span for a in Program(path, mmap_threshold=1)] == expected
+
+    start, end = expected[1]
+    assert source[start:end].strip().startswith("AUTO work_end")
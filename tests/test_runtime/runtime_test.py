@@ -0,0 +1,172 @@
+import asyncio
+import pytest
+from ottoscript.commands import Call, Turn
+from ottoscript.conditionals import Condition
+from ottoscript.datatypes import Entity
+from ottoscript.interpreters import Interpreter
+from ottoscript.ottobase import OttoBase, OttoContext
+
+
+class BulkInterpreter(Interpreter):
+
+    def __init__(self):
+        super().__init__()
+        self.single = []
+        self.bulk = []
+
+    async def get_state(self, entity_name):
+        self.single.append(entity_name)
+        return await super().get_state(entity_name)
+
+    async def get_states(self, entity_names):
+        self.bulk.append(entity_names)
+        return {name: 'off' for name in entity_names}
+
+
+@pytest.mark.asyncio
+async def test_batched_reads():
+    """Verify reads made together in a run become one get_states call"""
+
+    interpreter = BulkInterpreter()
+    ctx = OttoContext(interpreter=interpreter,
+                      concurrency=True,
+                      batch_reads=True)
+    OttoBase.set_context(ctx)
+
+    n = Condition().parse_string("sensor.a == 'on' OR sensor.b == 'on'"
+                                 " OR sensor.c:battery == 'on'")[0]
+
+    with ctx.run():
+        assert await n.eval() is False
+
+    assert interpreter.bulk == [['sensor.a', 'sensor.b', 'sensor.c.battery']]
+    assert interpreter.single == []
+    assert ctx.counters['read_batches'] == 1
+    assert ctx.counters['batched_reads'] == 3
+
+    # Outside of a run every read goes straight to get_state.
+    await n.eval()
+    assert interpreter.single == ['sensor.a', 'sensor.b', 'sensor.c.battery']
+
+
+@pytest.mark.asyncio
+async def test_batched_reads_fallback():
+    """Verify batching works with backends that only read one state"""
+
+    ctx = OttoContext(batch_reads=True)
+    OttoBase.set_context(ctx)
+
+    entities = [Entity().parse_string(name)[0]
+                for name in ('light.a', 'light.b:brightness')]
+
+    with ctx.run():
+        results = await asyncio.gather(*[e.eval() for e in entities])
+
+    assert results == ['light.a', 1]
+    assert ctx.counters['read_batches'] == 1
+
+
+@pytest.mark.asyncio
+async def test_batched_reads_missing_states():
+    """Verify names a backend leaves out read as None"""
+
+    class PartialInterpreter(Interpreter):
+        async def get_states(self, entity_names):
+            return {'sensor.a': 'on'}
+
+    ctx = OttoContext(interpreter=PartialInterpreter(), batch_reads=True)
+    OttoBase.set_context(ctx)
+
+    entities = [Entity().parse_string(name)[0]
+                for name in ('sensor.a', 'sensor.unknown', 'sensor.b')]
+
+    with ctx.run():
+        results = await asyncio.wait_for(
+            asyncio.gather(*[e.eval() for e in entities]), 1)
+
+    assert results == ['on', None, None]
+
+
+@pytest.mark.asyncio
+async def test_batched_reads_concurrent_fallback():
+    """Verify the default get_states makes its reads concurrently"""
+
+    class SlowInterpreter(Interpreter):
+        def __init__(self):
+            super().__init__()
+            self.active = 0
+            self.peak = 0
+
+        async def get_state(self, entity_name):
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            await asyncio.sleep(0.01)
+            self.active -= 1
+            return entity_name
+
+    interpreter = SlowInterpreter()
+    values = await interpreter.get_states(['sensor.a', 'sensor.b'])
+
+    assert values == {'sensor.a': 'sensor.a', 'sensor.b': 'sensor.b'}
+    assert interpreter.peak == 2
+
+
+@pytest.mark.asyncio
+async def test_batched_reads_cancelled():
+    """Verify cancelling a flush cancels the reads waiting on it"""
+
+    class StuckInterpreter(Interpreter):
+        async def get_states(self, entity_names):
+            await asyncio.Event().wait()
+
+    ctx = OttoContext(interpreter=StuckInterpreter(), batch_reads=True)
+    OttoBase.set_context(ctx)
+
+    # Cancelled before the flush starts, then while it waits.
+    for delay in (0, 0.01):
+        with ctx.run() as run:
+            read = asyncio.ensure_future(run.read('sensor.a'))
+            await asyncio.sleep(delay)
+
+            for flush in list(run.batcher.flushes):
+                flush.cancel()
+
+            with pytest.raises(asyncio.CancelledError):
+                await asyncio.wait_for(read, 1)
+
+
+@pytest.mark.asyncio
+async def test_state_snapshot():
+    """Verify each state is read once per run until it is written"""
+
+    interpreter = BulkInterpreter()
+    ctx = OttoContext(interpreter=interpreter, snapshot=True)
+    OttoBase.set_context(ctx)
+
+    n = Condition().parse_string("light.porch == 'on'"
+                                 " OR light.porch:brightness > 10"
+                                 " OR light.porch == 'off'")[0]
+    turn_on = Turn().parse_string("TURN ON light light.porch")[0]
+    dim = Call().parse_string("CALL light.brighten ON AREA kitchen")[0]
+
+    with ctx.run():
+        await n.eval()
+        await n.eval()
+        assert interpreter.single == ['light.porch', 'light.porch.brightness']
+        assert ctx.snapshot
+
+        await turn_on.eval()
+        await n.eval()
+        assert interpreter.single[2:] == ['light.porch',
+                                          'light.porch.brightness']
+
+        await dim.eval()
+        await n.eval()
+        assert len(interpreter.single) == 6
+
+    assert ctx.counters['snapshot_hits'] == 6
+
+    # Every run starts from fresh states.
+    with ctx.run():
+        await n.eval()
+    assert len(interpreter.single) == 8
@@ -1,6 +1,7 @@
 import pytest
 from ottoscript.time import TimeStamp, RelativeTime, Date, DateTime
 from ottoscript.interpreters import Interpreter
+from ottoscript.datatypes import Var
 
 interpreter = Interpreter()
 
@@ -18,6 +19,8 @@ async def test_timestamp():
     assert n2.string == "07:15:30"
     assert n2.seconds == 7 * 3600 + 15 * 60 + 30
 
+    assert type(TimeStamp().parse_string("@start")[0]) == Var
+
 
 @pytest.mark.asyncio
 async def test_relativetime():
@@ -0,0 +1,134 @@
+import json
+import pytest
+from ottoscript import vm
+from ottoscript.compiler import Compiler, assemble
+from ottoscript.controls import Actions
+from ottoscript.interpreters import Interpreter
+from ottoscript.ottobase import OttoBase, OttoContext
+from ottoscript.tracing import current_span
+
+SOURCE = """IF light.porch == 'light.porch'
+                TURN ON light light.hall
+            END"""
+
+TREE = [(0, 'run'),
+        (1, 'IfThenElse'),
+        (2, 'Condition'),
+        (3, 'Comparison'),
+        (2, 'CommandBlock'),
+        (3, 'Turn')]
+
+
+class FailingInterpreter(Interpreter):
+
+    async def call_service(self, domain, service_name, **kwargs):
+        raise RuntimeError("backend down")
+
+
+def runners(node):
+    """Ways of running node: eval, compiled closures and VM code"""
+    compiled = Compiler().compile(node)
+    code = assemble(node)
+
+    return {'eval': node.eval,
+            'compiled': compiled,
+            'vm': lambda: vm.run(code)}
+
+
+@pytest.mark.asyncio
+async def test_trace_spans():
+    """Verify a traced run records a span per part, with backend calls"""
+
+    ctx = OttoContext(tracing=True)
+    OttoBase.set_context(ctx)
+    n = Actions().parse_string(SOURCE)[0]
+
+    with ctx.run(('test', 'porch')):
+        await n.eval()
+
+    trace = ctx.traces[-1]
+    assert [(depth, span.name) for depth, span in trace.root.walk()] == TREE
+
+    _, comparison = list(trace.root.walk())[3]
+    assert comparison.text == "light.porch == light.porch"
+    assert comparison.calls == {'get_state': 1}
+    assert trace.root.total_calls() == {'get_state': 1, 'call_service': 1}
+    assert all(span.end >= span.start for _, span in trace.root.walk())
+
+    chrome = json.loads(json.dumps(trace.to_chrome()))
+    assert len(chrome['traceEvents']) == len(TREE)
+    assert chrome['traceEvents'][0]['args']['text'] == "('test', 'porch')"
+    assert chrome['traceEvents'][5]['args'] == {
+        'text': 'TURN ON light light.hall',
+        'calls': {'call_service': 1}
+    }
+
+    # Evals outside a run aren't traced.
+    await n.eval()
+    assert len(ctx.traces) == 1
+
+    OttoBase.set_context()
+
+
+@pytest.mark.asyncio
+async def test_trace_matches_compiled():
+    """Verify compiled closures and VM code record the same spans"""
+
+    for interpreter, error in ((Interpreter(), False),
+                               (FailingInterpreter(), True)):
+        ctx = OttoContext(interpreter=interpreter, tracing=True)
+        OttoBase.set_context(ctx)
+        n = Actions().parse_string(SOURCE)[0]
+
+        for name, run in runners(n).items():
+            try:
+                with ctx.run(name):
+                    await run()
+            except RuntimeError:
+                assert error
+
+            trace = ctx.traces[-1]
+            assert [(depth, span.name)
+                    for depth, span in trace.root.walk()] == TREE, name
+            assert trace.root.total_calls()['get_state'] == 1, name
+
+            errors = [span.name for _, span in trace.root.walk()
+                      if span.error]
+            if error:
+                assert errors == ['IfThenElse', 'CommandBlock', 'Turn'], name
+            else:
+                assert errors == [], name
+
+            assert current_span.get() is None
+
+    OttoBase.set_context()
+
+
+@pytest.mark.asyncio
+async def test_trace_belongs_to_run():
+    """Verify only runs of a tracing context record anything"""
+
+    traced = OttoContext(tracing=True)
+    ctx = OttoContext()
+    OttoBase.set_context(ctx)
+    n = Actions().parse_string(SOURCE)[0]
+
+    # Another context tracing, or one dropped without switching
+    # tracing off, leaves this one alone.
+    del traced
+    with ctx.run():
+        await n.eval()
+        assert current_span.get() is None
+
+    assert len(ctx.traces) == 0
+
+    ctx.tracing = True
+    with ctx.run():
+        await n.eval()
+    ctx.tracing = False
+    with ctx.run():
+        await n.eval()
+
+    assert len(ctx.traces) == 1
+
+    OttoBase.set_context()